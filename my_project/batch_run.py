@@ -0,0 +1,4 @@
+from my_project.batch import main
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,6 @@
+import sys
+
+from my_project.benchmark import main
+
+if __name__ == "__main__":
+    sys.exit(main())
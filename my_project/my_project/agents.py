@@ -1,13 +1,44 @@
-import mesa
-from my_project.random_walk import RandomWalker
 from enum import Enum
+from time import perf_counter
 
 class PoliticalParty(Enum):
     BLUE = 1
     GRAY = 2
     RED = 3
 
-class PoliticalAgent(mesa.Agent):
+# Small int party codes (the PoliticalParty values), agents store these
+BLUE = 1
+GRAY = 2
+RED = 3
+PARTY_OF_CODE = (None, PoliticalParty.BLUE, PoliticalParty.GRAY, PoliticalParty.RED)
+
+class SlottedAgent:
+    """
+    Same interface as mesa.Agent, but with __slots__ instead of a __dict__.
+
+    mesa.Agent gives every instance a __dict__, which a subclass can not take
+    away, so our agents start from here. Subclasses must list every
+    attribute they set in __slots__.
+    """
+
+    __slots__ = ("unique_id", "model", "pos")
+
+    def __init__(self, unique_id, model):
+        self.unique_id = unique_id
+        self.model = model
+        self.pos = None
+
+    def step(self):
+        pass
+
+    def advance(self):
+        pass
+
+    @property
+    def random(self):
+        return self.model.random
+
+class PoliticalAgent(SlottedAgent):
     """
     Base for any Agent with political party
 
@@ -16,8 +47,18 @@ class PoliticalAgent(mesa.Agent):
             Democrat (Blue) : from 0 - 127
             None (Gray)     : 128
             Republican (Red): from 129 - 256
+
+    The party is stored as its small int code in `party`, `political_party`
+    gives the PoliticalParty. It must be changed through
+    `update_party`/`set_party` so the scheduler's party tally stays current.
+
+    Subclasses give the tally of the scheduler they are added to in `tally`.
     """
 
+    __slots__ = ("political_party_inclination", "party")
+
+    tally = None
+
     def __init__(self, unique_id, pos, model, political_party_inclination):
         """
         grid: The MultiGrid object in which the agent lives.
@@ -30,21 +71,37 @@ class PoliticalAgent(mesa.Agent):
         self.pos = pos
 
         self.political_party_inclination = political_party_inclination
-        self.political_party = self.get_party()
+        self.party = self.get_party_code()
 
-    def get_party(self):
+    @property
+    def political_party(self):
+        return PARTY_OF_CODE[self.party]
+
+    @political_party.setter
+    def political_party(self, party):
+        self.party = party.value
+
+    def get_party_code(self):
         if self.political_party_inclination < 128:
-            return PoliticalParty.BLUE
+            return BLUE
         elif self.political_party_inclination > 128:
-            return PoliticalParty.RED
+            return RED
         else:
-            return PoliticalParty.GRAY
+            return GRAY
+
+    def get_party(self):
+        return PARTY_OF_CODE[self.get_party_code()]
 
     def update_party(self):
-        self.political_party = self.get_party()
+        code = self.get_party_code()
+        if code != self.party:
+            self.set_party(PARTY_OF_CODE[code])
 
     def set_party(self, party):
-        self.political_party = party
+        # Agents not placed yet are not in the tally either
+        if party.value != self.party and self.pos is not None:
+            self.tally.change(self, self.political_party, party)
+        self.party = party.value
 
 class Person(PoliticalAgent):
     """
@@ -53,7 +110,13 @@ class Person(PoliticalAgent):
     The init is the same as the RandomWalker.
     """
 
-    def __init__(self, unique_id, pos, model, political_party_inclination, age=20, max_age=80, influence=1, is_influencer=False):
+    __slots__ = ("age",)
+
+    is_influencer = False
+    # Radius of the neighborhood it talks to
+    influence = 1
+
+    def __init__(self, unique_id, pos, model, political_party_inclination, age=20):
         """
         grid: The MultiGrid object in which the agent lives.
         x: The agent's current x coordinate
@@ -63,40 +126,57 @@ class Person(PoliticalAgent):
         self.pos = pos
 
         self.age = age
-        self.max_age = max_age
-        self.influence = influence
-        self.is_influencer = is_influencer
+
+    @property
+    def max_age(self):
+        # Same for everyone, kept on the model
+        return self.model.max_age
+
+    @property
+    def tally(self):
+        return self.model.schedule.tally
 
     def random_move(self):
         """
         Step one cell in any allowable direction.
         """
         # Pick the next cell from the adjacent cells.
-        next_moves = self.model.grid.get_neighborhood(self.pos, True)
-        next_move = self.random.choice(next_moves)
+        index = self.model.index
+        next_move = self.random.choice(index.get_moves(index.cell(self.pos)))
         # Now move:
-        self.model.grid.move_agent(self, next_move)
+        index.move_agent(self, next_move)
 
     def step(self):
         """
         A model step. Move, then share & consume and reproduce.
         """
+        profiler = self.model.profiler
+        if profiler:
+            start = perf_counter()
+
         # Increase age
         self.age += 1
 
-        # Move
-        self.random_move()
+        # Move, in synchronous mode everyone moved at the start of the tick
+        if self.model.is_mobile and not self.model.synchronous:
+            self.random_move()
+        if profiler:
+            start = profiler.lap("movement", start)
 
         # Consumes & shares
-        neighbors = self.get_people()
-        people = [obj for obj in neighbors if isinstance(obj, (Person, Influencer))]
-        
+        people = self.get_people()
+        if profiler:
+            people = tuple(people)
+            start = profiler.lap("neighbors", start)
+
         for person in people:
             # Share to people? or is redundant?
             self.share_ideas(person)
             # self.consumes_ideas(person)
         
         self.update_party()
+        if profiler:
+            start = profiler.lap("ideas", start)
 
         if(self.model.is_mortal):
             # Reproduce
@@ -106,36 +186,35 @@ class Person(PoliticalAgent):
             # Death
             if self.age > self.max_age:
                 self.die()
+        if profiler:
+            profiler.lap("demography", start)
 
     def reproduce(self):
-        # Create a new person:
+        # Not over the carrying capacity of the grid, cell or territory
+        if not self.model.make_room(self.pos):
+            return
+        # Create a new person, placed with the rest of the births at the end of the tick
         offspring = Person(
-            self.model.next_id(), self.pos, self.model, self.political_party_inclination, 0, self.max_age
+            self.model.next_id(), self.pos, self.model, self.political_party_inclination, 0
         )
-        self.model.grid.place_agent(offspring, self.pos)
-        self.model.schedule.add(offspring)
+        self.model.births.append(offspring)
 
     def die(self):
-        self.model.grid.remove_agent(self)
-        self.model.schedule.remove(self)
+        # Stays in the grid & schedule until the end of the tick
+        self.model.deaths.append(self)
             
     def get_people(self):
-        people = []
-        neighborhood = self.model.grid.get_neighborhood(self.pos,True, self.influence)
-
-        # Equivalent to:
-        for cell in neighborhood:
-            contents = self.model.grid.get_cell_list_contents(cell)
-            for person in contents:
-                people.append(person)
-        # people = [person for cell in neighborhood for person in self.model.grid.get_cell_list_contents(cell)]
-
-        return people
+        # Persons & influencers within influence cells (own cell included),
+        # territory patches are kept apart by the index
+        return self.model.index.iter_people(self.pos, self.influence)
     
     # age determines how influenced is by others
         # young age < 18 -> very influenced
         # old   age > 50 -> low influenced
     def consumes_ideas(self, agent):
+        if self.model.synchronous:
+            self.buffer_ideas(agent)
+            return
         #print("before political inclination=",self.political_party_inclination)
         political_difference = agent.political_party_inclination - self.political_party_inclination
         #print("political difference=",political_difference)
@@ -149,6 +228,36 @@ class Person(PoliticalAgent):
         self.political_party_inclination = clamp(self.political_party_inclination,0,256)
         #print("post political inclination=",self.political_party_inclination)
 
+    def buffer_ideas(self, agent):
+        """
+        consumes_ideas of the synchronous mode: the inclinations of this tick are
+        only read, the result goes to model.next_ideas and is applied by
+        Simulation.apply_ideas at the end of the tick.
+
+        Stores [retention, weight total, weighted sum of inclinations], the
+        result is the average of consuming the ideas one after the other over
+        every order (same as the vectorized backend).
+        """
+        # The agent is in its own neighborhood, but does not consume its own ideas
+        if agent is self:
+            return
+        weight = 1 + self.model.influencer_influence if agent.is_influencer else 1
+        factor = self.model.proximity_influence * weight
+        if self.age < 18 or self.age > 50:
+            factor *= 1.25 if self.age < 18 else .75
+
+        buffer = self.model.next_ideas.get(self)
+        if buffer is None:
+            buffer = self.model.next_ideas[self] = [1.0, 0, 0]
+        buffer[0] *= 1 - factor
+        buffer[1] += weight
+        buffer[2] += weight * agent.political_party_inclination
+
+    def set_party(self, party):
+        if party.value != self.party and self.pos is not None:
+            self.model.index.party_changed(self, self.political_party, party)
+        super().set_party(party)
+
     def share_ideas(self, agent):
         if(self.model.influencer_changes and isinstance(agent,Influencer)):
             agent.consumes_ideas(self)
@@ -158,7 +267,13 @@ class Influencer(Person):
     """
     This person will have a greater impact in media
     """
-    def __init__(self, unique_id, pos, model, political_party_inclination, age=20, max_age=80, influence=2, followers=100):
+
+    __slots__ = ("followers",)
+
+    is_influencer = True
+    influence = 2
+
+    def __init__(self, unique_id, pos, model, political_party_inclination, age=20, followers=100):
         """
         grid: The MultiGrid object in which the agent lives.
         x: The agent's current x coordinate
@@ -166,16 +281,17 @@ class Influencer(Person):
         moore: If True, may move in all 8 directions.
                 Otherwise, only up, down, left, right.
         """
-        super().__init__(unique_id, pos, model, political_party_inclination, age, max_age, influence, True)
+        super().__init__(unique_id, pos, model, political_party_inclination, age)
         self.followers = followers
 
     def reproduce(self):
+        if not self.model.make_room(self.pos):
+            return
         # Create a new person:
         offspring = Influencer(
-            self.model.next_id(), self.pos, self.model, self.political_party_inclination, 0, self.max_age
+            self.model.next_id(), self.pos, self.model, self.political_party_inclination, 0
         )
-        self.model.grid.place_agent(offspring, self.pos)
-        self.model.schedule.add(offspring)
+        self.model.births.append(offspring)
 
 class Territory(PoliticalAgent):
     """
@@ -183,8 +299,14 @@ class Territory(PoliticalAgent):
 
         The territories will change color depending on 
         the average political party of the citizens
+
+        All the patches of a territory share a TerritoryRecord with its
+        residents by party, only the capital needs to step to update it.
     """
-    def __init__(self, unique_id, pos, model, territory_id=None, is_capital=False, capital=None,political_party_inclination=128):
+
+    __slots__ = ("territory_id", "is_capital", "record", "territory")
+
+    def __init__(self, unique_id, pos, model, territory_id=None, is_capital=False, political_party_inclination=128, record=None):
         """
         Creates a new patch of grass
         """
@@ -193,10 +315,17 @@ class Territory(PoliticalAgent):
 
         self.territory_id = territory_id
         self.is_capital = is_capital
+        self.record = record
         if(is_capital):
             self.territory = []
-        else:
-            self.capital = capital
+
+    @property
+    def capital(self):
+        return self.record.capital
+
+    @property
+    def tally(self):
+        return self.model.schedule_patch.tally
 
     def step(self):
         # if(self.is_capital):
@@ -213,23 +342,10 @@ class Territory(PoliticalAgent):
         return self.territory
     
     def get_patch(self, pos):
-        contents = self.model.grid.get_cell_list_contents(pos)
-
-        for agent in contents:
-            if(isinstance(agent, Territory)):
-                return agent
-            
-        return None
+        return self.model.index.get_patch(pos)
     
     def get_people(self, pos):
-        people = []
-        contents = self.model.grid.get_cell_list_contents(pos)
-
-        for agent in contents:
-            if(isinstance(agent, (Person, Influencer))):
-                people.append(agent)
-            
-        return people
+        return self.model.index.get_cell_people(pos)
     
     def get_territory_patches(self):
         patches = []
@@ -254,29 +370,18 @@ class Territory(PoliticalAgent):
     
     def count_party(self):
         # in order [BLUE, GRAY, RED] or [democrat, none, republican]
-        population_party = {PoliticalParty.BLUE:0,PoliticalParty.GRAY:0,PoliticalParty.RED:0}
-
-        population = self.get_territory_people()
-
-        for person in population:
-            population_party[person.political_party] += 1
-
-        # print("capital ",self.territory_id," population party = ", population_party)
-        
-        return population_party
+        return self.record.population_party
     
     def get_territory_party(self):
-        territory_count_party = self.count_party()
-        party = max(territory_count_party,key=lambda k: territory_count_party[k])
-
-        return party
+        return self.record.get_party()
     
     def update_party(self):
         if(self.is_capital):
-            self.political_party = self.get_territory_party()
+            # Also sets the party of the rest of the patches when it changes
+            self.record.update()
             # print("capital ",self.territory_id," party = ", self.political_party)
         else:
-            self.political_party = self.get_patch(self.capital).political_party
+            self.set_party(self.record.political_party)
 
 def clamp(value, smallest, largest):
     return max(smallest, min(value, largest))
\ No newline at end of file
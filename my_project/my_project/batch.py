@@ -0,0 +1,223 @@
+"""
+Headless batch runs
+================================
+Runs every combination of a grid of Simulation parameters, for a number of
+seeds, across a pool of processes. The DataCollector output of each run is
+written to its own file as soon as the run finishes and recorded in
+manifest.jsonl, so an interrupted sweep can be resumed with --resume.
+
+Runs are reproducible: the seed drives every random source of the
+Simulation, so a run already in the manifest never needs to run again.
+A run that fails is recorded in the manifest with its error instead, the
+sweep goes on and exits with status 1 listing the failed runs; --resume
+runs them again.
+
+With --format npy the runs stream their reporters to a .npy file while they
+run (see sink.py) instead of keeping them in memory until the end.
+
+Example:
+    python batch_run.py --param initial_person=100,200 --param enable_influencer=true \
+        --seeds 0-9 --steps 200 --out results
+"""
+
+import argparse
+import hashlib
+import inspect
+import itertools
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from my_project.model import Simulation
+from my_project.partition import PartitionedPopulation
+
+MANIFEST = "manifest.jsonl"
+
+
+def get_model_defaults():
+    """
+    Parameters of the Simulation constructor with their default values.
+    """
+    signature = inspect.signature(Simulation.__init__)
+    return {
+        name: parameter.default
+        for name, parameter in signature.parameters.items()
+        if name not in ("self", "seed", "stream_path", "stream_chunk", "reporters", "stop_on")
+    }
+
+
+def parse_value(text, default):
+    if isinstance(default, bool):
+        if text.lower() in ("1", "true", "yes"):
+            return True
+        if text.lower() in ("0", "false", "no"):
+            return False
+        raise ValueError("not a boolean: " + text)
+    if isinstance(default, int):
+        # initial_percentage=0 takes fractions too
+        try:
+            return int(text)
+        except ValueError:
+            return float(text)
+    if isinstance(default, float):
+        return float(text)
+    return text
+
+
+def parse_param(text, defaults):
+    """
+    'name=v1,v2,...' -> (name, [v1, v2, ...])
+    """
+    name, _, values = text.partition("=")
+    if name not in defaults:
+        raise ValueError("unknown Simulation parameter: " + name)
+    return name, [parse_value(value, defaults[name]) for value in values.split(",")]
+
+
+def parse_seeds(text):
+    """
+    '0-9' or '1,2,5' -> list of seeds
+    """
+    seeds = []
+    for part in text.split(","):
+        first, _, last = part.partition("-")
+        seeds += range(int(first), int(last or first) + 1)
+    return seeds
+
+
+def get_run_key(params, seed, steps):
+    """
+    Same parameters, seed & steps always give the same key (and file name).
+    """
+    text = json.dumps({"params": params, "seed": seed, "steps": steps}, sort_keys=True)
+    return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+
+def get_runs(grid, seeds, steps):
+    """
+    Every combination of the grid for every seed. A run is fully determined by
+    its key, so repeated combinations are only run once.
+    """
+    names = list(grid)
+    keys = set()
+    for values in itertools.product(*(grid[name] for name in names)):
+        params = dict(zip(names, values))
+        for seed in seeds:
+            key = get_run_key(params, seed, steps)
+            if key in keys:
+                continue
+            keys.add(key)
+            yield {
+                "key": key,
+                "params": params,
+                "seed": seed,
+                "steps": steps,
+            }
+
+
+def run_one(run, out, output_format="csv"):
+    """
+    Runs a single simulation and writes its model variables to out/run_<key>.<format>.
+    """
+    path = os.path.join(out, "run_" + run["key"] + "." + output_format)
+    # Written under a temporary name so a killed run never looks finished
+    stream_path = path + ".tmp" if output_format == "npy" else None
+    model = Simulation(seed=run["seed"], stream_path=stream_path, **run["params"])
+    try:
+        model.run_model(run["steps"])
+        if output_format == "npy":
+            model.datacollector.flush()
+        else:
+            model.datacollector.get_model_vars_dataframe().set_index("Step").to_csv(path + ".tmp")
+    finally:
+        # Worker processes & shared memory of the run
+        if isinstance(model.population, PartitionedPopulation):
+            model.population.close()
+        if model.shared is not None:
+            model.shared.close()
+    os.replace(path + ".tmp", path)
+
+    return dict(run, file=os.path.basename(path), steps_run=model.schedule.steps, stop_reason=model.stop_reason)
+
+
+def read_manifest(out):
+    done = set()
+    path = os.path.join(out, MANIFEST)
+    if os.path.exists(path):
+        with open(path) as manifest:
+            for line in manifest:
+                entry = json.loads(line)
+                # Failed runs are run again
+                if "error" in entry:
+                    continue
+                if os.path.exists(os.path.join(out, entry["file"])):
+                    done.add(entry["key"])
+    return done
+
+
+def run_batch(grid, seeds, steps, out, processes=None, resume=False, output_format="csv"):
+    """
+    Runs the sweep, returns the number of runs executed and the manifest
+    entries of the ones that failed. A failed run does not stop the rest.
+    """
+    os.makedirs(out, exist_ok=True)
+    done = read_manifest(out) if resume else set()
+    runs = [run for run in get_runs(grid, seeds, steps) if run["key"] not in done]
+    print("runs=", len(runs), " skipped=", len(done))
+
+    with ProcessPoolExecutor(max_workers=processes) as pool, \
+            open(os.path.join(out, MANIFEST), "a" if resume else "w") as manifest:
+        futures = {pool.submit(run_one, run, out, output_format): run for run in runs}
+        failed = []
+        for i, future in enumerate(as_completed(futures)):
+            try:
+                entry = future.result()
+            except Exception as error:
+                entry = dict(futures[future], error="{}: {}".format(type(error).__name__, error))
+                failed.append(entry)
+            manifest.write(json.dumps(entry) + "\n")
+            manifest.flush()
+            print(i + 1, "/", len(runs), entry.get("file") or "failed " + entry["error"])
+
+    return len(runs), failed
+
+
+def main(argv=None):
+    defaults = get_model_defaults()
+    parser = argparse.ArgumentParser(description="Run Simulation parameter sweeps without the UI.")
+    parser.add_argument(
+        "--param", action="append", default=[], metavar="NAME=V1,V2",
+        help="values of a Simulation parameter, one of: " + ", ".join(defaults),
+    )
+    parser.add_argument("--seeds", default="0", help="seeds to run for every combination, e.g. 0-9 or 1,2,5")
+    parser.add_argument("--steps", type=int, default=200, help="steps of each run")
+    parser.add_argument("--out", default="results", help="output directory")
+    parser.add_argument("--processes", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--resume", action="store_true", help="skip runs already finished in --out")
+    parser.add_argument(
+        "--format", choices=("csv", "npy"), default="csv",
+        help="csv, or npy to stream each run to disk while it runs (read it with sink.load_series)",
+    )
+    parser.add_argument(
+        "--reporters", default=None, metavar="NAME,NAME",
+        help="model reporters to collect (default: all), e.g. Republican,Democrat",
+    )
+    parser.add_argument(
+        "--stop-on", default=None, metavar="NAME,NAME",
+        help="end runs early when settled: extinct, consensus and/or stationary (see convergence.py)",
+    )
+    args = parser.parse_args(argv)
+
+    grid = dict(parse_param(param, defaults) for param in args.param)
+    if args.reporters is not None:
+        # A single value of the grid, so it is part of the run keys
+        grid["reporters"] = [args.reporters.split(",")]
+    if args.stop_on is not None:
+        grid["stop_on"] = [args.stop_on.split(",")]
+    _, failed = run_batch(grid, parse_seeds(args.seeds), args.steps, args.out, args.processes, args.resume, args.format)
+    if failed:
+        print(len(failed), "runs failed:")
+        for entry in failed:
+            print(" ", entry["key"], entry["params"], "seed=", entry["seed"], entry["error"])
+        sys.exit(1)
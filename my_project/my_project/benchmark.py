@@ -0,0 +1,175 @@
+"""
+Benchmarks
+================================
+Times Simulation construction (and setup_territories within it), steps per
+second and peak memory over a matrix of grid sizes, populations and
+toggles, and writes the results as JSON so two branches can be compared:
+
+    python benchmark.py --out main.json
+    python benchmark.py --out branch.json --compare main.json
+"""
+
+import argparse
+import itertools
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime
+
+from my_project.model import Simulation
+
+# Slower than this ratio against the compared results is reported as a regression
+REGRESSION = 1.25
+
+
+class TimedSimulation(Simulation):
+    """
+    Simulation that records how long setup_territories took.
+    """
+
+    setup_territories_time = 0.0
+
+    def setup_territories(self):
+        start = time.perf_counter()
+        super().setup_territories()
+        self.setup_territories_time = time.perf_counter() - start
+
+
+def get_case_name(case):
+    return "size=%(size)d people=%(people)d hex=%(is_hex)d territory=%(territory)d influencer=%(influencer)d vectorized=%(vectorized)d" % case
+
+
+def get_params(case):
+    return dict(
+        width=case["size"],
+        height=case["size"],
+        initial_person=case["people"],
+        initial_influencer=case["people"] // 2,
+        is_hex=case["is_hex"],
+        enable_territory=case["territory"],
+        enable_influencer=case["influencer"],
+        vectorized=case["vectorized"],
+        seed=0,
+    )
+
+
+def run_case(case, steps):
+    params = get_params(case)
+    result = {"name": get_case_name(case), "case": case, "steps": steps}
+    try:
+        start = time.perf_counter()
+        model = TimedSimulation(**params)
+        result["construction"] = time.perf_counter() - start
+        result["setup_territories"] = model.setup_territories_time
+        result["agents"] = model.schedule.get_agent_count() + len(model.population or ())
+
+        start = time.perf_counter()
+        model.run_model(steps)
+        result["steps_per_second"] = steps / (time.perf_counter() - start)
+
+        # Separate pass, tracemalloc slows everything down
+        tracemalloc.start()
+        model = Simulation(**params)
+        model.run_model(steps)
+        result["peak_memory"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    except Exception as error:
+        tracemalloc.stop()
+        result["error"] = "%s: %s" % (type(error).__name__, error)
+    return result
+
+
+def get_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, path, threshold=REGRESSION):
+    """
+    Prints the change of every timing against the results in path.
+    """
+    with open(path) as f:
+        baseline = {result["name"]: result for result in json.load(f)["results"]}
+
+    regressions = 0
+    for result in results:
+        old = baseline.get(result["name"])
+        if old is None or "error" in result or "error" in old:
+            continue
+        # Ratio > 1 means slower (or bigger) than the baseline
+        ratios = {
+            "construction": result["construction"] / max(old["construction"], 1e-9),
+            "steps": old["steps_per_second"] / max(result["steps_per_second"], 1e-9),
+            "memory": result["peak_memory"] / max(old["peak_memory"], 1),
+        }
+        slower = [name for name, ratio in ratios.items() if ratio > threshold]
+        regressions += bool(slower)
+        print(
+            "%-80s construction x%.2f steps x%.2f memory x%.2f %s"
+            % (result["name"], ratios["construction"], ratios["steps"], ratios["memory"],
+               "REGRESSION " + ",".join(slower) if slower else "")
+        )
+    return regressions
+
+
+def parse_list(text, kind=int):
+    if kind is bool:
+        return [value.lower() in ("1", "true", "yes") for value in text.split(",")]
+    return [kind(value) for value in text.split(",")]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark Simulation construction, step throughput and memory.")
+    parser.add_argument("--sizes", default="20,50,100", help="grid widths (square grids)")
+    parser.add_argument("--people", default="100,1000", help="initial persons (influencers are half)")
+    parser.add_argument("--hex", default="false,true")
+    parser.add_argument("--territory", default="false,true")
+    parser.add_argument("--influencer", default="false,true")
+    parser.add_argument("--vectorized", default="false,true")
+    parser.add_argument("--steps", type=int, default=20, help="steps timed per case")
+    parser.add_argument("--out", default="benchmark.json", help="JSON file for the results")
+    parser.add_argument("--compare", default=None, help="JSON results of another branch to compare with")
+    parser.add_argument("--threshold", type=float, default=REGRESSION, help="slowdown ratio reported as a regression")
+    args = parser.parse_args(argv)
+
+    names = ("size", "people", "is_hex", "territory", "influencer", "vectorized")
+    values = (
+        parse_list(args.sizes), parse_list(args.people), parse_list(args.hex, bool),
+        parse_list(args.territory, bool), parse_list(args.influencer, bool), parse_list(args.vectorized, bool),
+    )
+
+    results = []
+    for combination in itertools.product(*values):
+        case = dict(zip(names, combination))
+        result = run_case(case, args.steps)
+        results.append(result)
+        if "error" in result:
+            print(result["name"], "ERROR", result["error"])
+        else:
+            print(
+                "%-80s construction=%.3fs steps/s=%.1f peak=%.1fMB"
+                % (result["name"], result["construction"], result["steps_per_second"], result["peak_memory"] / 2**20)
+            )
+
+    with open(args.out, "w") as f:
+        json.dump(
+            {
+                "date": datetime.now().isoformat(),
+                "commit": get_commit(),
+                "python": platform.python_version(),
+                "results": results,
+            },
+            f, indent=2,
+        )
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        print("regressions=", regressions)
+        return 1 if regressions else 0
+    return 0
@@ -0,0 +1,168 @@
+"""
+Media reach of the influencers.
+
+Every influencer has a number of followers (Influencer.followers), persons
+drawn at random from the whole grid, not only its neighborhood. The graph
+is a sparse matrix with one row per person and one column per influencer,
+and every tick each follower moves its inclination towards the mean
+inclination of the influencers it follows:
+
+    x' = x + broadcast_influence * (mean(x_followed) - x)
+
+which is one sparse matrix-vector product for the whole population.
+
+The links belong to the people, not to their place in the population:
+every person & influencer is known by a key that never changes (its
+unique_id, or the key column of the vectorized backend). When people are
+born or die the rows & columns of the dead are dropped, and links are only
+drawn for the newcomers:
+
+    new influencer  Influencer.followers persons drawn from everyone
+    newborn person  follows every influencer with probability
+                    followers / persons, so the share stays the same
+
+These draws come from a generator seeded with the seed of the model and
+model.people_version, and the links are stored in the checkpoints, so runs
+and checkpoints stay reproducible.
+
+scipy is used for the matrix if it is installed, otherwise the product is
+done with np.bincount over the same links.
+"""
+
+import numpy as np
+
+try:
+    from scipy import sparse
+except ImportError:
+    sparse = None
+
+
+class FollowerNetwork:
+    """
+    Links from persons to the influencers they follow.
+    """
+
+    def __init__(self):
+        self.version = None
+        # Keys of the persons (rows) & influencers (columns) of the links
+        self.person_keys = np.zeros(0, dtype=np.int64)
+        self.influencer_keys = np.zeros(0, dtype=np.int64)
+        self.matrix = None
+        # Without scipy: the links as (person, influencer) arrays
+        self.rows = np.zeros(0, dtype=np.int64)
+        self.columns = np.zeros(0, dtype=np.int64)
+        # Number of influencers each person follows
+        self.following = np.zeros(0, dtype=np.int64)
+
+    def update(self, model, person_keys, influencer_keys, followers):
+        """
+        Follows the people born & dead since the last call.
+        person_keys, influencer_keys: keys of the people, in population order.
+        followers: number of followers of every influencer.
+
+        Both backends keep the order of the people and add the newborns at
+        the end, so the people left are the first ones and the rest are new.
+        """
+        if self.version == model.people_version:
+            return
+        self.version = model.people_version
+        person_keys = np.asarray(person_keys, dtype=np.int64)
+        influencer_keys = np.asarray(influencer_keys, dtype=np.int64)
+        followers = np.asarray(followers, dtype=np.int64)
+
+        keep_rows = np.isin(self.person_keys, person_keys, assume_unique=True)
+        keep_columns = np.isin(self.influencer_keys, influencer_keys, assume_unique=True)
+        if not keep_rows.all() or not keep_columns.all():
+            self.drop(keep_rows, keep_columns)
+        old_persons, old_influencers = len(self.person_keys), len(self.influencer_keys)
+        num_persons, num_influencers = len(person_keys), len(influencer_keys)
+        self.person_keys, self.influencer_keys = person_keys, influencer_keys
+        if (old_persons, old_influencers) == (num_persons, num_influencers):
+            return
+
+        rng = np.random.default_rng([model.seed, model.people_version])
+        # Newborn persons follow the influencers there were
+        reach = followers[:old_influencers] / max(num_persons, 1)
+        counts = rng.binomial(num_persons - old_persons, np.minimum(reach, 1))
+        columns = [np.repeat(np.arange(old_influencers), counts)]
+        rows = [old_persons + rng.integers(max(num_persons - old_persons, 1), size=len(columns[0]))]
+        # New influencers get followers among all the persons
+        counts = np.minimum(followers[old_influencers:], num_persons)
+        columns.append(old_influencers + np.repeat(np.arange(num_influencers - old_influencers), counts))
+        rows.append(rng.integers(max(num_persons, 1), size=len(columns[1])))
+        self.append(np.concatenate(rows), np.concatenate(columns), num_persons, num_influencers)
+
+    def drop(self, keep_rows, keep_columns):
+        """
+        Drops the dead persons & influencers, and every link to them.
+        """
+        if self.matrix is not None:
+            self.matrix = self.matrix[keep_rows][:, keep_columns]
+            self.following = np.diff(self.matrix.indptr)
+        else:
+            row_index = np.cumsum(keep_rows) - 1
+            column_index = np.cumsum(keep_columns) - 1
+            alive = keep_rows[self.rows] & keep_columns[self.columns]
+            self.rows = row_index[self.rows[alive]]
+            self.columns = column_index[self.columns[alive]]
+            self.following = np.bincount(self.rows, minlength=keep_rows.sum())
+        self.person_keys = self.person_keys[keep_rows]
+        self.influencer_keys = self.influencer_keys[keep_columns]
+
+    def append(self, rows, columns, num_persons, num_influencers):
+        """
+        Adds the links of the newcomers, the rest of the links stay as they are.
+        """
+        # Following someone twice is following them once
+        links = np.unique(rows * max(num_influencers, 1) + columns)
+        rows, columns = np.divmod(links, max(num_influencers, 1))
+
+        following = np.zeros(num_persons, dtype=np.int64)
+        following[:len(self.following)] = self.following
+        self.following = following + np.bincount(rows, minlength=num_persons)
+        if sparse is not None:
+            new = sparse.csr_matrix((np.ones(len(rows)), (rows, columns)), shape=(num_persons, num_influencers))
+            if self.matrix is None:
+                self.matrix = new
+            else:
+                self.matrix.resize((num_persons, num_influencers))
+                self.matrix = self.matrix + new
+        else:
+            self.rows = np.concatenate([self.rows, rows])
+            self.columns = np.concatenate([self.columns, columns])
+
+    def get_links(self):
+        """
+        Persons & influencers (as positions) of every link, for the checkpoints.
+        """
+        if self.matrix is not None:
+            links = self.matrix.tocoo()
+            return links.row.astype(np.int64), links.col.astype(np.int64)
+        return self.rows, self.columns
+
+    def set_links(self, version, person_keys, influencer_keys, rows, columns):
+        """
+        Restores the links saved with get_links.
+        """
+        self.__init__()
+        self.version = version
+        self.person_keys = np.asarray(person_keys, dtype=np.int64)
+        self.influencer_keys = np.asarray(influencer_keys, dtype=np.int64)
+        self.append(np.asarray(rows, dtype=np.int64), np.asarray(columns, dtype=np.int64),
+                    len(self.person_keys), len(self.influencer_keys))
+
+    def broadcast(self, person_inclination, influencer_inclination, strength):
+        """
+        New inclinations of the persons, rounded & clipped like every update.
+        """
+        x = np.asarray(person_inclination, dtype=np.float64)
+        sources = np.asarray(influencer_inclination, dtype=np.float64)
+        if self.matrix is not None:
+            total = self.matrix @ sources
+        else:
+            total = np.bincount(self.rows, weights=sources[self.columns], minlength=len(x))
+
+        reached = self.following > 0
+        mean = np.divide(total, self.following, out=x.copy(), where=reached)
+        x = x + strength * (mean - x)
+        return np.clip(np.rint(x), 0, 256).astype(np.int64)
@@ -0,0 +1,234 @@
+"""
+Checkpoints of the full state of a Simulation.
+
+Agents are not pickled one by one: their attributes are stored as NumPy
+columns (one array per attribute, in schedule order) in a compressed .npz
+file, next to a small JSON header with the parameters, RNG states, schedule
+counters and next_id. Restoring rebuilds the agents from those columns.
+"""
+
+import inspect
+import json
+import os
+
+import numpy as np
+
+from my_project.agents import Person, Influencer, Territory, PoliticalParty
+from my_project.partition import PartitionedPopulation
+from my_project.sink import StreamingDataCollector
+from my_project.territory import TerritoryRecord
+from my_project.vectorized import COLUMNS
+
+# Agent classes stored in the "kind" column
+KINDS = (Person, Influencer)
+
+
+def get_params(model):
+    """
+    Constructor arguments of the Simulation, read back from its attributes.
+    Subclasses (like FrameSimulation) may take other arguments, so the
+    signature is the one of Simulation.
+    """
+    # Not at the top, model.py imports this module
+    from my_project.model import Simulation
+
+    signature = inspect.signature(Simulation.__init__)
+    return {name: getattr(model, name) for name in signature.parameters if name != "self"}
+
+
+def get_network(model):
+    """
+    Follower network of the model, of the agents or of the vectorized population.
+    """
+    if model.population is not None:
+        return model.population.network
+    return model.network
+
+
+def save_checkpoint(model, path):
+    arrays = {}
+    header = {
+        "params": get_params(model),
+        "current_id": model.current_id,
+        "running": model.running,
+        "stop_reason": model.stop_reason,
+        "random": model.random.getstate(),
+        "seed_children": model.seed_sequence.n_children_spawned,
+        "schedule": [model.schedule.steps, model.schedule.time],
+        "schedule_patch": [model.schedule_patch.steps, model.schedule_patch.time],
+        "type_order": [KINDS.index(t) for t in model.schedule.agents_by_type],
+        "people_version": model.people_version,
+        "party_history": list(model.party_history),
+    }
+
+    # Agents, in schedule order
+    agents = model.schedule.agents
+    arrays["unique_id"] = np.array([a.unique_id for a in agents], dtype=np.int64)
+    arrays["kind"] = np.array([KINDS.index(type(a)) for a in agents], dtype=np.int8)
+    arrays["pos"] = np.array([a.pos for a in agents], dtype=np.int32).reshape(-1, 2)
+    arrays["inclination"] = np.array([a.political_party_inclination for a in agents], dtype=np.int16)
+    arrays["party"] = np.array([a.party for a in agents], dtype=np.int8)
+    arrays["age"] = np.array([a.age for a in agents], dtype=np.int32)
+    arrays["followers"] = np.array([getattr(a, "followers", 0) for a in agents], dtype=np.int32)
+    # Order of the agents inside each cell, it decides who shares ideas first
+    position = {agent.unique_id: i for i, agent in enumerate(agents)}
+    arrays["place_order"] = np.array(
+        [position[a.unique_id] for people in model.index.people for a in people], dtype=np.int64
+    )
+
+    # Territories
+    if model.territory_labels is not None:
+        arrays["territory_labels"] = model.territory_labels
+        arrays["capitals"] = np.array([r.capital for r in model.territories], dtype=np.int32)
+        arrays["territory_party"] = np.array([r.political_party.value for r in model.territories], dtype=np.int8)
+        patches = model.schedule_patch.agents
+        arrays["patch_id"] = np.array([p.unique_id for p in patches], dtype=np.int64)
+        arrays["patch_pos"] = np.array([p.pos for p in patches], dtype=np.int32)
+        arrays["patch_party"] = np.array([p.party for p in patches], dtype=np.int8)
+
+    # Vectorized population
+    population = model.population
+    if isinstance(population, PartitionedPopulation):
+        raise ValueError("checkpoints of partitioned runs are not supported")
+    if population is not None:
+        header["rng"] = population.rng.bit_generator.state
+        header["next_key"] = population.next_key
+        for column in COLUMNS + ("key",):
+            arrays["population_" + column] = getattr(population, column)
+
+    # Follower links
+    network = get_network(model)
+    if network is not None and network.version is not None:
+        header["network_version"] = network.version
+        arrays["network_person_keys"] = network.person_keys
+        arrays["network_influencer_keys"] = network.influencer_keys
+        arrays["network_rows"], arrays["network_columns"] = network.get_links()
+
+    # Collected data so far
+    datacollector = model.datacollector
+    if isinstance(datacollector, StreamingDataCollector):
+        datacollector.flush()
+        header["written"] = datacollector.written
+        header["stream_size"] = os.path.getsize(datacollector.path)
+    header["model_vars"] = list(datacollector.model_vars)
+    for i, values in enumerate(datacollector.model_vars.values()):
+        arrays["model_var_%d" % i] = np.asarray(values)
+
+    arrays["header"] = np.array(json.dumps(header))
+    # Written under a temporary name so a crash never leaves half a checkpoint
+    with open(path + ".tmp", "wb") as f:
+        np.savez_compressed(f, **arrays)
+    os.replace(path + ".tmp", path)
+
+
+def read_header(data):
+    return json.loads(str(data["header"]))
+
+
+def restore_checkpoint(model, data):
+    """
+    Restores the state of a checkpoint into model, created empty with the same parameters.
+    """
+    header = read_header(data)
+
+    model.current_id = header["current_id"]
+    model.running = header["running"]
+    model.stop_reason = header["stop_reason"]
+    model.party_history.extend(header["party_history"])
+    version, state, gauss = header["random"]
+    model.random.setstate((version, tuple(state), gauss))
+    model.seed_sequence = np.random.SeedSequence(model.seed, n_children_spawned=header["seed_children"])
+    model.schedule.steps, model.schedule.time = header["schedule"]
+    model.schedule_patch.steps, model.schedule_patch.time = header["schedule_patch"]
+
+    if "territory_labels" in data:
+        restore_territories(model, data)
+
+    if model.population is not None:
+        population = model.population
+        population.rng.bit_generator.state = header["rng"]
+        population.next_key = header["next_key"]
+        for column in COLUMNS + ("key",):
+            setattr(population, column, data["population_" + column])
+        population.update_counts()
+    else:
+        restore_agents(model, header, data)
+    model.people_version = header["people_version"]
+
+    network = get_network(model)
+    if network is not None and "network_version" in header:
+        network.set_links(
+            header["network_version"], data["network_person_keys"], data["network_influencer_keys"],
+            data["network_rows"], data["network_columns"],
+        )
+
+    datacollector = model.datacollector
+    for i, name in enumerate(header["model_vars"]):
+        datacollector.model_vars[name] = data["model_var_%d" % i].tolist()
+    if isinstance(datacollector, StreamingDataCollector):
+        datacollector.written = header["written"]
+        # Drop whatever was streamed after the checkpoint was taken
+        with open(datacollector.path, "r+b") as stream:
+            stream.truncate(header["stream_size"])
+
+
+def restore_territories(model, data):
+    model.set_territory_labels(data["territory_labels"])
+    for territory_id, (capital, party) in enumerate(zip(data["capitals"].tolist(), data["territory_party"].tolist())):
+        record = TerritoryRecord(territory_id, tuple(capital))
+        record.political_party = PoliticalParty(party)
+        model.territories.append(record)
+
+    for unique_id, pos, party in zip(data["patch_id"].tolist(), data["patch_pos"].tolist(), data["patch_party"].tolist()):
+        pos = tuple(pos)
+        territory_id = int(model.territory_labels[pos[0] * model.height + pos[1]])
+        record = model.territories[territory_id]
+        is_capital = pos == record.capital
+        patch = Territory(unique_id, pos, model, territory_id, is_capital=is_capital, record=record)
+        patch.party = party
+        record.add_patch(patch)
+        model.index.place_patch(patch, pos)
+        model.schedule_patch.add(patch, active=is_capital)
+        if not is_capital:
+            record.patches[0].add_territory(pos)
+
+
+def restore_agents(model, header, data):
+    for kind in header["type_order"]:
+        model.schedule.agents_by_type[KINDS[kind]]
+
+    agents = []
+    columns = zip(
+        data["unique_id"].tolist(), data["kind"].tolist(), data["inclination"].tolist(),
+        data["party"].tolist(), data["age"].tolist(), data["followers"].tolist(),
+    )
+    for unique_id, kind, inclination, party, age, followers in columns:
+        if KINDS[kind] is Influencer:
+            agent = Influencer(unique_id, None, model, inclination, age, followers)
+        else:
+            agent = Person(unique_id, None, model, inclination, age)
+        agent.party = party
+        model.schedule.add(agent)
+        agents.append(agent)
+
+    positions = data["pos"].tolist()
+    for i in data["place_order"].tolist():
+        model.index.place_agent(agents[i], tuple(positions[i]))
+
+
+def load_checkpoint(model_class, path):
+    """
+    Creates a model of model_class from the checkpoint in path.
+    """
+    with np.load(path) as data:
+        params = read_header(data)["params"]
+        # Created without agents or territories, they come from the checkpoint
+        empty = dict(params, initial_person=0, initial_influencer=0, enable_territory=False, stream_path=None)
+        model = model_class(**empty)
+        model.__dict__.update(params)
+        if params["stream_path"] is not None:
+            model.datacollector = StreamingDataCollector(
+                model.datacollector.model_reporters, params["stream_path"], params["stream_chunk"], append=True
+            )
+        restore_checkpoint(model, data)
+    return model
@@ -0,0 +1,49 @@
+"""
+Stop conditions of a run.
+
+Simulation(stop_on=[...]) checks the named detectors after every step; the
+first one that fires sets model.running to False and its name is kept in
+model.stop_reason, so run_model (and the batch runs) stop early.
+
+    extinct     nobody is left
+    consensus   everyone is of the same party
+    stationary  the shares of the parties (Republican, Democrat & None
+                reporters) moved less than stationary_tolerance over the
+                last stationary_window collected rows
+
+The stationary detector reads model.party_history, the party counts of the
+last stationary_window collected rows kept by the model itself, so it works
+the same when the reporters are streamed to disk.
+"""
+
+import numpy as np
+
+from my_project.agents import PoliticalParty
+
+PARTY_REPORTERS = ("Republican", "Democrat", "None")
+
+
+def is_extinct(model):
+    return model.count_people() == 0
+
+
+def has_consensus(model):
+    people = model.count_people()
+    return people > 0 and any(model.count_party(party) == people for party in PoliticalParty)
+
+
+def is_stationary(model):
+    history = model.party_history
+    if len(history) < model.stationary_window:
+        return False
+    counts = np.array(history, dtype=np.float64).T
+    total = counts.sum(axis=0)
+    shares = np.divide(counts, total, out=np.zeros_like(counts), where=total > 0)
+    return (shares.max(axis=1) - shares.min(axis=1)).max() <= model.stationary_tolerance
+
+
+STOP_DETECTORS = {
+    "extinct": is_extinct,
+    "consensus": has_consensus,
+    "stationary": is_stationary,
+}
@@ -0,0 +1,126 @@
+"""
+Decoupling the model speed from the frame rate of the server
+============================================================
+ModularServer steps the model once and renders every element for each
+frame the browser asks for. With FrameSimulation each frame advances:
+
+    steps_per_frame steps   (frame_time=0), or
+    frame_time seconds      the model runs in a background thread until
+                            frame_time seconds after the last frame request,
+                            the frames render whatever step it is at.
+
+FrameServer renders between two steps of the background thread (never in
+the middle of one) and stops the thread of the old model on reset.
+SampledChartModule draws the rows collected since the previous frame, at
+most max_points of them, instead of one point per frame.
+"""
+
+import os
+import threading
+import time
+
+import mesa
+
+from my_project.model import Simulation
+
+
+class FrameSimulation(Simulation):
+    """
+    Simulation that runs several steps for every frame of the server.
+    """
+
+    def __init__(self, *args, steps_per_frame=1, frame_time=0.0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.steps_per_frame = steps_per_frame
+        self.frame_time = frame_time
+        # Held by the background thread while it steps, and by the server while it renders
+        self.frame_lock = threading.Lock()
+        self.thread = None
+        self.deadline = 0.0
+        self.stopped = False
+
+    def step(self):
+        if self.frame_time > 0:
+            self.deadline = time.perf_counter() + self.frame_time
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run_frames, daemon=True)
+                self.thread.start()
+            return
+
+        for _ in range(self.steps_per_frame):
+            if not self.running:
+                break
+            super().step()
+
+    def run_frames(self):
+        """
+        Background thread: steps while there is frame time left.
+        """
+        while self.running and not self.stopped:
+            if time.perf_counter() >= self.deadline:
+                time.sleep(0.005)
+                continue
+            with self.frame_lock:
+                super().step()
+
+    def stop(self):
+        self.stopped = True
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+
+class FrameServer(mesa.visualization.ModularServer):
+    """
+    ModularServer for a FrameSimulation.
+    """
+
+    def reset_model(self):
+        model = getattr(self, "model", None)
+        if model is not None:
+            model.stop()
+        super().reset_model()
+
+    def render_model(self):
+        with self.model.frame_lock:
+            return super().render_model()
+
+
+class SampledChartModule(mesa.visualization.ChartModule):
+    """
+    ChartModule that sends the rows collected since the last frame (at most
+    max_points of them, evenly spaced) labeled with their step.
+    """
+
+    local_includes = ["SampledChartModule.js"]
+    local_dir = os.path.join(os.path.dirname(__file__), "resources")
+
+    def __init__(self, series, canvas_height=200, canvas_width=500, data_collector_name="datacollector", max_points=10):
+        super().__init__(series, canvas_height, canvas_width, data_collector_name)
+        self.js_code = self.js_code.replace("new ChartModule(", "new SampledChartModule(")
+        self.max_points = max_points
+        self.model = None
+        self.last_step = 0
+
+    def render(self, model):
+        if model is not self.model:
+            self.model = model
+            self.last_step = -1
+        model_vars = getattr(model, self.data_collector_name).model_vars
+        # The rows collected since the last frame are the last ones
+        steps = model_vars.get("Step", [])
+        new = 0
+        while new < len(steps) and steps[-new - 1] > self.last_step:
+            new += 1
+        if new:
+            self.last_step = steps[-1]
+
+        stride = max(-(-new // self.max_points), 1)
+        # Counting back from the last row, so it is always drawn
+        rows = sorted(range(1, new + 1, stride), reverse=True)
+        # Reporters not collected are drawn as 0, like ChartModule
+        columns = [model_vars.get(s["Label"]) for s in self.series]
+        return {
+            "steps": [steps[-row] for row in rows],
+            "values": [[column[-row] if column else 0 for column in columns] for row in rows],
+        }
@@ -4,11 +4,39 @@ Political Evolution Model
 TODO INFO
 """
 
+from collections import Counter, deque
+
 import mesa
+import numpy as np
 
 from my_project.scheduler import RandomActivationByTypeFiltered, BaseActivationByTypeFiltered
-from my_project.agents import Person, Influencer, Territory, PoliticalParty
-import random
+from my_project.agents import Person, Influencer, Territory, PoliticalParty, clamp
+from my_project.vectorized import VectorizedPopulation
+from my_project.partition import PartitionedPopulation
+from my_project.shared import SharedArrays
+from my_project.space import SpatialIndex
+from my_project.territory import TerritoryRecord, partition_territories
+from my_project.sink import StreamingDataCollector
+from my_project import checkpoint
+from my_project.profiler import StepProfiler
+from my_project.broadcast import FollowerNetwork
+from my_project.convergence import STOP_DETECTORS, PARTY_REPORTERS
+from time import perf_counter
+
+# Reporters a Simulation can collect, see the reporters argument
+MODEL_REPORTERS = {
+    "Person": lambda m: m.schedule.get_party_count(Person),
+    "Influencer": lambda m: m.schedule.get_party_count(Influencer),
+    "Republican": lambda m: m.count_party(PoliticalParty.RED),
+    "Democrat": lambda m: m.count_party(PoliticalParty.BLUE),
+    "None": lambda m: m.count_party(PoliticalParty.GRAY),
+    "Republican Spaces": lambda m: m.schedule_patch.get_party_count(
+        Territory, PoliticalParty.RED),
+    "Democrat Spaces": lambda m: m.schedule_patch.get_party_count(
+        Territory, PoliticalParty.BLUE),
+    # Only with profile=True
+    "Agents per Second": lambda m: m.profiler.last_rate,
+}
 
 class Simulation(mesa.Model):
     """
@@ -57,7 +85,25 @@ class Simulation(mesa.Model):
         influencer_changes=True,
         enable_influencer=False,
         enable_territory=False,
-        is_hex=False
+        is_hex=False,
+        vectorized=False,
+        seed=None,
+        stream_path=None,
+        stream_chunk=1000,
+        profile=False,
+        synchronous=False,
+        partitions=1,
+        shared_memory=False,
+        collect_every=1,
+        reporters=None,
+        broadcast_influence=0.0,
+        stop_on=None,
+        stationary_window=50,
+        stationary_tolerance=0.01,
+        carrying_capacity=0,
+        cell_capacity=0,
+        territory_capacity=0,
+        is_mobile=True
     ):
         # TODO update Args
         """
@@ -71,6 +117,53 @@ class Simulation(mesa.Model):
             influencer_reproduce
             enable_influencer
             enable_territory
+            vectorized: Step persons and influencers as NumPy arrays instead of
+                        agents, see vectorized.py
+            seed: Seed of every random source of the model (territories,
+                  initial agents, movement, reproduction and the vectorized
+                  backend). If None a random one is drawn, and kept in
+                  self.seed so the run can be reproduced.
+            stream_path: If given, the model reporters are appended to this
+                         .npy file every stream_chunk steps instead of being
+                         kept in memory, see sink.py
+            profile: Time every phase of the steps, see profiler.py
+            synchronous: Everyone moves at the start of the tick (in one
+                         batch), then influencers read the inclinations of
+                         the previous tick and all change together at its
+                         end, so the result does not depend on the
+                         activation order (the vectorized backend always
+                         works like this)
+            partitions: With vectorized, split the grid in this many strips
+                        stepped by as many worker processes, see partition.py
+            shared_memory: Keep the occupancy of the cells, the territory
+                           labels and the vectorized columns in shared
+                           memory (self.shared), see shared.py
+            collect_every: Collect the reporters every this many steps (and
+                           at the start and end of run_model), 0 only at
+                           the start and end of run_model
+            reporters: Names of the MODEL_REPORTERS to collect, None for all
+                       of them ("Agents per Second" only with profile).
+                       "Step" is always collected
+            broadcast_influence: Pull of the influencers on their followers
+                                 every tick (0 to 1), 0 disables the
+                                 follower network, see broadcast.py
+            stop_on: Names of the detectors that end the run early
+                     ("extinct", "consensus", "stationary"), see
+                     convergence.py. The reason is kept in self.stop_reason
+            stationary_window, stationary_tolerance: Collected rows and
+                     change of the party shares of the stationary detector
+            carrying_capacity: Most people the grid holds, births beyond it
+                               do not happen (0, no limit)
+            cell_capacity: Most people in a cell (0, no limit)
+            territory_capacity: Most residents of a territory (0, no limit)
+                                The capacities count the people of the tick
+                                (those dying in it too) plus the births
+                                granted so far. They only limit births:
+                                the initial population is not limited and
+                                people can still walk into a full cell
+            is_mobile: People take a random step every tick. Without
+                       moves the people around each cell are cached, see
+                       SpatialIndex.get_people_near
 
             initial_sheep: Number of sheep to start with
             initial_wolves: Number of wolves to start with
@@ -82,7 +175,13 @@ class Simulation(mesa.Model):
                                  once it is eaten
             sheep_gain_from_food: Energy sheep gain from grass, if enabled.
         """
-        super().__init__()
+        super().__init__(seed=seed)
+        # Every random stream of the run comes from this seed: model.random
+        # (agents, territories) and independent NumPy streams spawned from
+        # seed_sequence (vectorized backend).
+        self.seed_sequence = np.random.SeedSequence(seed)
+        self.seed = self.seed_sequence.entropy
+        self.reset_randomizer(self.seed)
         # Set parameters
         self.is_hex = is_hex
         self.width = width
@@ -100,6 +199,53 @@ class Simulation(mesa.Model):
         self.influencer_changes=influencer_changes
         self.enable_influencer=enable_influencer
         self.enable_territory=enable_territory
+        self.vectorized=vectorized
+        self.stream_path=stream_path
+        self.stream_chunk=stream_chunk
+        self.profile=profile
+        self.synchronous=synchronous
+        self.partitions=partitions
+        self.shared_memory=shared_memory
+        self.collect_every=collect_every
+        self.broadcast_influence=broadcast_influence
+        self.stop_on=list(stop_on or [])
+        self.stationary_window=stationary_window
+        self.stationary_tolerance=stationary_tolerance
+        self.stop_reason = None
+        # Party counts of the last collected rows, read by the stationary detector
+        self.party_history = deque(maxlen=stationary_window)
+        self.carrying_capacity=carrying_capacity
+        self.cell_capacity=cell_capacity
+        self.territory_capacity=territory_capacity
+        self.capped = bool(carrying_capacity or cell_capacity or territory_capacity)
+        self.is_mobile=is_mobile
+        if partitions > 1 and (carrying_capacity or territory_capacity):
+            raise ValueError("only cell_capacity is supported with partitions")
+        for name in self.stop_on:
+            if name not in STOP_DETECTORS:
+                raise ValueError("unknown stop detector: " + name)
+        self.shared = SharedArrays() if shared_memory else None
+        if self.shared is not None:
+            self.shared.register()
+        if partitions > 1 and not vectorized:
+            raise ValueError("partitions needs vectorized=True")
+        if partitions > 1 and broadcast_influence:
+            raise ValueError("broadcast_influence is not supported with partitions")
+        # Changes every time people are born or die, see broadcast.py
+        self.people_version = 0
+        self.network = FollowerNetwork() if broadcast_influence and not vectorized else None
+        self.profiler = StepProfiler() if profile else None
+        self.population = None
+        # Influencer -> [retention, weight total, weighted sum] in synchronous mode
+        self.next_ideas = {}
+        # Births & deaths of the tick, applied together at its end
+        self.births = []
+        self.deaths = []
+        # Births granted this tick per cell & territory, with capacities
+        self.cell_births = Counter()
+        self.territory_births = Counter()
+        self.territories = []
+        self.territory_labels = None
 
         self.schedule = RandomActivationByTypeFiltered(self)
         self.schedule_patch = BaseActivationByTypeFiltered(self)
@@ -107,159 +253,343 @@ class Simulation(mesa.Model):
             self.grid = mesa.space.HexGrid(self.width, self.height, torus=True)
         else:
             self.grid = mesa.space.MultiGrid(self.width, self.height, torus=True)
+        # People & patches of each cell, agents are placed through it
+        self.index = SpatialIndex(self.grid, is_hex)
+        # Neighborhoods only change with births & deaths
+        self.index.cache_people = not is_mobile
+        if self.shared is not None:
+            self.shared.create("size", (1,), np.int64)
+            self.index.occupancy = self.shared.create("occupancy", (self.width * self.height,), np.int32)
 
         
-        self.datacollector = mesa.DataCollector(
-            {
-                "Person": lambda m: m.schedule.get_type_count(Person),
-                "Influencer": lambda m: m.schedule.get_type_count(Influencer),
-                "Republican": lambda m: m.schedule.get_type_count(
-                    Person, lambda x: x.political_party == PoliticalParty.RED) +
-                    m.schedule.get_type_count(
-                    Influencer, lambda x: x.political_party == PoliticalParty.RED),
-                "Democrat": lambda m: m.schedule.get_type_count(
-                    Person, lambda x: x.political_party == PoliticalParty.BLUE) +
-                    m.schedule.get_type_count(
-                    Influencer, lambda x: x.political_party == PoliticalParty.BLUE),
-                "None": lambda m: m.schedule.get_type_count(
-                    Person, lambda x: x.political_party == PoliticalParty.GRAY) +
-                    m.schedule.get_type_count(
-                    Influencer, lambda x: x.political_party == PoliticalParty.GRAY),
-                "Republican Spaces": lambda m: m.schedule_patch.get_type_count(
-                    Territory, lambda x: x.political_party == PoliticalParty.RED),
-                "Democrat Spaces": lambda m: m.schedule_patch.get_type_count(
-                    Territory, lambda x: x.political_party == PoliticalParty.BLUE),
-            }
-        )
+        if reporters is None:
+            reporters = [name for name in MODEL_REPORTERS if profile or name != "Agents per Second"]
+        for name in reporters:
+            if name not in MODEL_REPORTERS:
+                raise ValueError("unknown reporter: " + name)
+        if "Agents per Second" in reporters and not profile:
+            raise ValueError("the Agents per Second reporter needs profile=True")
+        self.reporters = list(reporters)
+        # Step of every collected row, the other reporters only run when collecting
+        model_reporters = {"Step": lambda m: m.schedule.steps}
+        model_reporters.update((name, MODEL_REPORTERS[name]) for name in self.reporters)
+        if stream_path is None:
+            self.datacollector = mesa.DataCollector(model_reporters)
+        else:
+            self.datacollector = StreamingDataCollector(model_reporters, stream_path, stream_chunk)
 
         # Create territory patches
         if self.enable_territory:
             self.setup_territories()
 
+        # Create person & influencer as arrays
+        if self.vectorized:
+            if self.partitions > 1:
+                self.population = PartitionedPopulation(self, self.partitions)
+            else:
+                self.population = VectorizedPopulation(self)
+            self.population.populate()
+
         # Create person:
-        for i in range(self.initial_person):
+        for i in range(0 if self.vectorized else self.initial_person):
             x = self.random.randrange(self.width)
             y = self.random.randrange(self.height)
             political = 256 if i < self.initial_person * self.initial_percentage else 0
             age = self.random.randrange(self.max_age)
-            person = Person(self.next_id(), (x, y), self, political, age, self.max_age)
-            self.grid.place_agent(person, (x, y))
+            person = Person(self.next_id(), (x, y), self, political, age)
+            self.index.place_agent(person, (x, y))
             self.schedule.add(person)
 
         # Create influencer
-        if self.enable_influencer:
+        if self.enable_influencer and not self.vectorized:
             for i in range(self.initial_influencer):
                 x = self.random.randrange(self.width)
                 y = self.random.randrange(self.height)
                 political = 256 if i < self.initial_influencer * self.initial_percentage else 0
                 age = self.random.randrange(self.max_age)
                 followers = self.random.randrange(1000)
-                influencer = Influencer(self.next_id(), (x, y), self, political, age, self.max_age, self.influencer_influence, followers)
-                self.grid.place_agent(influencer, (x, y))
+                influencer = Influencer(self.next_id(), (x, y), self, political, age, followers=followers)
+                self.index.place_agent(influencer, (x, y))
                 self.schedule.add(influencer)
 
         self.running = True
-        self.datacollector.collect(self)
+        self.collect()
 
     def setup_territories(self):
         # Random create capitals for each
         capitals = list(zip(
-                random.sample(range(self.width), self.number_territory),
-                random.sample(range(self.height), self.number_territory),
-                range(self.number_territory)
+                self.random.sample(range(self.width), self.number_territory),
+                self.random.sample(range(self.height), self.number_territory),
             ))
-        print("capitals=",capitals)
+        if self.verbose:
+            print("capitals=",capitals)
+
+        # Every cell goes to the territory of its closest capital
+        self.set_territory_labels(partition_territories(self.width, self.height, capitals, self.is_hex))
         
         # Creating capitals of the Territory
         capitals_agents = []
-        for x, y, territory_id in capitals:
-            patch = Territory(self.next_id(), (x, y), self, territory_id, is_capital=True)
-            self.grid.place_agent(patch, (x, y))
-            self.schedule_patch.add(patch)
+        for territory_id, (x, y) in enumerate(capitals):
+            record = TerritoryRecord(territory_id, (x, y))
+            self.territories.append(record)
+            patch = Territory(self.next_id(), (x, y), self, territory_id, is_capital=True, record=record)
+            record.add_patch(patch)
+            self.index.place_patch(patch, (x, y))
             capitals_agents.append(patch)
+        self.schedule_patch.add_many(capitals_agents)
         
-        # Expanding capitals by neighborhoods
-        radius = 1
-        while len(self.grid.empties) != 0:
-            for x, y, territory_id in capitals:
-                if(self.is_hex):
-                    neighborhood = self.grid.get_neighborhood((x, y),False, radius)
-                else:
-                    neighborhood = self.grid.get_neighborhood((x, y), True, False, radius)
-                print("\tterritory_id=",territory_id," neighborhood=",len(neighborhood))
-                for neighbor in neighborhood:
-                    if self.grid.empties == 0:
-                        break
-                    if self.grid.is_cell_empty(neighbor):
-                        print("\t\tneigbor is empty=",neighbor)
-                        patch = Territory(self.next_id(), neighbor, self, territory_id, capital=(x,y))
-                        self.grid.place_agent(patch, neighbor)
-                        self.schedule_patch.add(patch)
-                        capitals_agents[territory_id].add_territory(neighbor)
-                    
-            print("radius=",radius,' empties=',len(self.grid.empties))
-            radius += 1
+        # Filling the rest of the cells with patches of their territory
+        patches = []
+        for cell, territory_id in enumerate(self.territory_labels.tolist()):
+            pos = (cell // self.height, cell % self.height)
+            record = self.territories[territory_id]
+            if pos == record.capital:
+                continue
+            patch = Territory(self.next_id(), pos, self, territory_id, record=record)
+            record.add_patch(patch)
+            self.index.place_patch(patch, pos)
+            patches.append(patch)
+            capitals_agents[territory_id].add_territory(pos)
+        # Only capitals step, the rest follow the shared record
+        self.schedule_patch.add_many(patches, active=False)
+
+    def set_territory_labels(self, labels):
+        if self.shared is not None:
+            labels = self.shared.share("territory_labels", labels)
+        self.territory_labels = labels
+
+    def count_party(self, party):
+        """
+        Number of people (persons and influencers) of the given party.
+        """
+        return (self.schedule.get_party_count(Person, party) +
+                self.schedule.get_party_count(Influencer, party))
 
     def step(self):
+        profiler = self.profiler
+        if profiler:
+            tick_start = start = perf_counter()
+            agents = self.schedule.get_agent_count() + len(self.population or ())
+
+        if self.synchronous and self.is_mobile:
+            self.move_people()
+            if profiler:
+                start = profiler.lap("moves", start)
         self.schedule.step()
+        if profiler:
+            start = profiler.lap("schedule", start)
+        if self.next_ideas:
+            self.apply_ideas()
+            if profiler:
+                start = profiler.lap("swap", start)
+        self.apply_demography()
+        if profiler:
+            start = profiler.lap("births_deaths", start)
+        if self.network is not None:
+            self.broadcast()
+            if profiler:
+                start = profiler.lap("broadcast", start)
+        if self.population is not None:
+            self.population.step()
+            if profiler:
+                start = profiler.lap("vectorized", start)
         self.schedule_patch.step()
+        if profiler:
+            start = profiler.lap("patches", start)
+            profiler.tick(start - tick_start, agents)
         # collect data
-        self.datacollector.collect(self)
+        collected = self.collect_every and self.schedule.steps % self.collect_every == 0
+        if collected:
+            self.collect()
+        if self.stop_on:
+            self.check_stop(collected)
+        if profiler:
+            profiler.lap("collect", start)
         if self.verbose:
             print(
                 [
                     self.schedule.time,
-                    self.schedule.get_type_count(Person),
-                    self.schedule.get_type_count(Influencer),
-                    self.schedule.get_type_count(
-                    Person, lambda x: x.political_party == PoliticalParty.RED),
-                    self.schedule.get_type_count(
-                    Person, lambda x: x.political_party == PoliticalParty.BLUE),
-                    self.schedule_patch.get_type_count(
-                    Territory, lambda x: x.political_party == PoliticalParty.RED),
-                    self.schedule_patch.get_type_count(
-                    Territory, lambda x: x.political_party == PoliticalParty.BLUE),
+                    self.schedule.get_party_count(Person),
+                    self.schedule.get_party_count(Influencer),
+                    self.schedule.get_party_count(Person, PoliticalParty.RED),
+                    self.schedule.get_party_count(Person, PoliticalParty.BLUE),
+                    self.schedule_patch.get_party_count(Territory, PoliticalParty.RED),
+                    self.schedule_patch.get_party_count(Territory, PoliticalParty.BLUE),
                 ]
             )
 
-    def run_model(self, step_count=200):
+    def count_people(self):
+        return self.schedule.get_party_count(Person) + self.schedule.get_party_count(Influencer)
+
+    def check_stop(self, collected=True):
+        """
+        Stops the run when one of the stop_on detectors fires.
+        """
+        for name in self.stop_on:
+            # The stationary detector only looks at collected rows
+            if name == "stationary" and not collected:
+                continue
+            if STOP_DETECTORS[name](self):
+                self.running = False
+                self.stop_reason = name
+                return
+
+    def collect(self):
+        """
+        Collects the reporters for the current step, if they were not already.
+        """
+        steps = self.datacollector.model_vars.get("Step")
+        if not steps or steps[-1] != self.schedule.steps:
+            self.datacollector.collect(self)
+            if "stationary" in self.stop_on:
+                self.party_history.append([MODEL_REPORTERS[name](self) for name in PARTY_REPORTERS])
+
+    def move_people(self):
+        """
+        Synchronous mode: every person and influencer takes its random step,
+        drawn for all of them at once.
+        """
+        agents = self.schedule.agents
+        if not agents:
+            return
+        height = self.height
+        cells = np.fromiter((a.pos[0] * height + a.pos[1] for a in agents), np.int64, len(agents))
+        table, count = self.index.get_move_table()
+        # A generator per tick seeded from model.random, nothing else to checkpoint
+        rng = np.random.default_rng(self.random.getrandbits(64))
+        choice = (rng.random(len(agents)) * count[cells]).astype(np.int64)
+        self.index.move_many(agents, table[cells, choice].tolist())
+
+    def broadcast(self):
+        """
+        Followers move towards the influencers they follow (see broadcast.py).
+        """
+        persons_by_id = self.schedule.agents_by_type[Person]
+        influencers_by_id = self.schedule.agents_by_type[Influencer]
+        persons = list(persons_by_id.values())
+        influencers = list(influencers_by_id.values())
+        self.network.update(
+            self, list(persons_by_id), list(influencers_by_id), [influencer.followers for influencer in influencers]
+        )
+
+        before = np.fromiter((p.political_party_inclination for p in persons), np.int64, len(persons))
+        sources = np.fromiter((i.political_party_inclination for i in influencers), np.int64, len(influencers))
+        after = self.network.broadcast(before, sources, self.broadcast_influence)
+        for i in np.flatnonzero(after != before).tolist():
+            person = persons[i]
+            person.political_party_inclination = int(after[i])
+            person.update_party()
+
+    def make_room(self, pos):
+        """
+        Whether a person can be born in pos without going over a capacity,
+        if so the birth is counted. Every check reads a maintained counter.
+        """
+        if not self.capped:
+            return True
+        if self.carrying_capacity and self.count_people() + len(self.births) >= self.carrying_capacity:
+            return False
+        cell = self.index.cell(pos)
+        if self.cell_capacity and len(self.index.people[cell]) + self.cell_births[cell] >= self.cell_capacity:
+            return False
+        record = self.index.territory_of[cell]
+        if self.territory_capacity and record is not None:
+            residents = sum(record.population_party.values())
+            if residents + self.territory_births[record.territory_id] >= self.territory_capacity:
+                return False
+            self.territory_births[record.territory_id] += 1
+        self.cell_births[cell] += 1
+        return True
+
+    def apply_ideas(self):
+        """
+        Synchronous mode: sets the inclinations buffered during the tick.
+        """
+        for agent, (retention, weight_total, weighted_sum) in self.next_ideas.items():
+            mean = weighted_sum / weight_total
+            inclination = retention * agent.political_party_inclination + (1 - retention) * mean
+            agent.political_party_inclination = clamp(round(inclination), 0, 256)
+            agent.update_party()
+        self.next_ideas = {}
+
+    def apply_demography(self):
+        """
+        Removes the agents that died during the tick and places the newborns.
+        """
+        if self.deaths or self.births:
+            self.people_version += 1
+        if self.deaths:
+            self.index.remove_many(self.deaths)
+            self.schedule.remove_many(self.deaths)
+            self.deaths = []
+        if self.births:
+            self.index.place_many(self.births)
+            self.schedule.add_many(self.births)
+            self.births = []
+        if self.capped:
+            self.cell_births.clear()
+            self.territory_births.clear()
+
+    def save_checkpoint(self, path):
+        """
+        Saves the full state of the simulation to path (see checkpoint.py).
+        """
+        checkpoint.save_checkpoint(self, path)
+
+    @classmethod
+    def load_checkpoint(cls, path):
+        """
+        Creates a simulation from a checkpoint written by save_checkpoint.
+        """
+        return checkpoint.load_checkpoint(cls, path)
+
+    def run_model(self, step_count=200, checkpoint_path=None, checkpoint_every=500):
 
         if self.verbose:
             print(
                 "Initial number Republican: ", 
-                self.schedule.get_type_count(Person, lambda x: x.political_party == PoliticalParty.RED)
+                self.schedule.get_party_count(Person, PoliticalParty.RED)
             )
             print(
                 "Initial number Democrat: ", 
-                self.schedule.get_type_count(Person, lambda x: x.political_party == PoliticalParty.BLUE)
+                self.schedule.get_party_count(Person, PoliticalParty.BLUE)
             )
             print(
                 "Initial number Republican Territory: ",
-                self.schedule_patch.get_type_count(Territory, lambda x: x.political_party == PoliticalParty.RED),
+                self.schedule_patch.get_party_count(Territory, PoliticalParty.RED),
             )
             print(
                 "Initial number Democrat Territory: ",
-                self.schedule_patch.get_type_count(Territory, lambda x: x.political_party == PoliticalParty.BLUE),
+                self.schedule_patch.get_party_count(Territory, PoliticalParty.BLUE),
             )
 
         for i in range(step_count):
+            if not self.running:
+                break
             self.step()
+            if checkpoint_path is not None and self.schedule.steps % checkpoint_every == 0:
+                self.save_checkpoint(checkpoint_path)
+        # The final state, whatever collect_every is
+        self.collect()
 
         if self.verbose:
             print("")
             print(
                 "Final number Republican: ", 
-                self.schedule.get_type_count(Person, lambda x: x.political_party == PoliticalParty.RED)
+                self.schedule.get_party_count(Person, PoliticalParty.RED)
             )
             print(
                 "Final number Democrat: ", 
-                self.schedule.get_type_count(Person, lambda x: x.political_party == PoliticalParty.BLUE)
+                self.schedule.get_party_count(Person, PoliticalParty.BLUE)
             )
             print(
                 "Final number Republican Territory: ",
-                self.schedule_patch.get_type_count(Territory, lambda x: x.political_party == PoliticalParty.RED),
+                self.schedule_patch.get_party_count(Territory, PoliticalParty.RED),
             )
             print(
                 "Final number Democrat Territory: ",
-                self.schedule_patch.get_type_count(Territory, lambda x: x.political_party == PoliticalParty.BLUE),
+                self.schedule_patch.get_party_count(Territory, PoliticalParty.BLUE),
             )
+
+        if self.profiler:
+            print(self.profiler.summary())
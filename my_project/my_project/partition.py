@@ -0,0 +1,323 @@
+"""
+Spatial domain decomposition of the vectorized backend.
+
+With Simulation(vectorized=True, partitions=N) the torus is cut into N
+strips of whole columns (x ranges, which are ranges of cell ids) and every
+strip is owned by a worker process that steps the people living in it.
+Each tick every worker:
+
+    1. ages & moves its people, and sends the ones that left its strip to
+       the worker owning their new cell (they only move one cell, so always
+       to a neighbor strip)
+    2. writes the source grids of its cells (people & inclination sums per
+       cell, see VectorizedPopulation.get_source_grids) into a grid in
+       shared memory and waits for the rest at a barrier. After it every
+       worker reads the halo it needs (up to INFLUENCER_RADIUS columns of
+       the neighbor strips) straight from the shared grid
+    3. lets its influencers consume ideas, reproduces & kills its people
+    4. sends its party counts back; the coordinator (the Simulation) adds
+       them into the tally & territory records read by the reporters.
+
+The source grid and the territory labels are SharedArrays (see shared.py),
+the workers attach to them instead of receiving copies. With
+Simulation(shared_memory=True) every worker also writes the occupancy of
+its cells into model.shared; the columns of the people stay in the workers.
+
+Runs are reproducible for a given seed and number of partitions, but not
+across different numbers of partitions (every worker has its own random
+stream).
+
+A worker that fails sends its traceback to the coordinator and breaks the
+barrier, so the other workers stop waiting for it; the step raises a
+WorkerError and the workers are closed. A worker that dies without a word
+is noticed by the coordinator while it waits for the answers.
+"""
+
+import multiprocessing
+import queue
+import threading
+import traceback
+import weakref
+from types import SimpleNamespace
+
+import numpy as np
+
+from my_project.shared import SharedArrays
+from my_project.vectorized import VectorizedPopulation, COLUMNS, SOURCE_GROUPS, set_counts
+
+# Simulation attributes the workers need
+MODEL_PARAMS = (
+    "width", "height", "is_hex", "max_age", "is_mortal", "person_reproduce",
+    "proximity_influence", "influencer_influence", "influencer_changes",
+    "number_territory", "broadcast_influence", "capped", "carrying_capacity",
+    "cell_capacity", "territory_capacity", "is_mobile",
+)
+
+# Seconds between checks for dead workers while waiting on them
+POLL_TIME = 0.5
+
+
+class WorkerError(RuntimeError):
+    """
+    A worker process failed or died.
+    """
+
+
+def get_strips(width, partitions):
+    """
+    First x of every strip, and of the one after the last.
+    """
+    return [width * k // partitions for k in range(partitions + 1)]
+
+
+class TilePopulation(VectorizedPopulation):
+    """
+    The people of one strip, stepped in a worker process.
+    """
+
+    def __init__(self, model, strip, strips, inbox, outboxes, barrier, grids):
+        super().__init__(model)
+        self.strip = strip
+        self.first_cell = strips[strip] * model.height
+        self.last_cell = strips[strip + 1] * model.height
+        # Strip owning each column
+        self.owner = np.repeat(np.arange(len(strips) - 1), np.diff(strips))
+        self.neighbors = sorted({(strip - 1) % len(outboxes), (strip + 1) % len(outboxes)} - {strip})
+        self.inbox = inbox
+        self.outboxes = outboxes
+        self.barrier = barrier
+        self.grids = grids
+        self.counts = None
+
+    def random_move(self):
+        super().random_move()
+        self.migrate()
+
+    def migrate(self):
+        """
+        Sends the people that left the strip to the neighbor owning their cell.
+        """
+        owner = self.owner[self.cell // self.model.height]
+        for neighbor in self.neighbors:
+            leaving = owner == neighbor
+            self.outboxes[neighbor].put((self.strip, {column: getattr(self, column)[leaving] for column in COLUMNS}))
+            self.remove(leaving)
+            owner = owner[~leaving]
+
+        # Always in the same order, so the runs are reproducible
+        arrivals = sorted((self.receive() for _ in self.neighbors), key=lambda message: message[0])
+        for _, columns in arrivals:
+            self.add(*(columns[column] for column in COLUMNS))
+
+    def receive(self):
+        """
+        Next message of the inbox, gives up once the barrier is broken (some
+        worker failed and will not send anything).
+        """
+        while True:
+            try:
+                return self.inbox.get(timeout=POLL_TIME)
+            except queue.Empty:
+                if self.barrier.broken:
+                    raise threading.BrokenBarrierError
+
+    def share_ideas(self):
+        # Every worker publishes its cells, even without influencers
+        grids = self.get_source_grids()
+        self.grids[:, :, self.first_cell:self.last_cell] = grids[:, :, self.first_cell:self.last_cell]
+        self.barrier.wait()
+
+        consumers = np.flatnonzero(self.is_influencer)
+        if len(consumers):
+            self.consume_ideas(consumers, self.grids)
+
+    def update_counts(self):
+        self.counts = self.get_counts()
+        if self.model.shared is not None:
+            self.publish()
+
+    def publish(self):
+        cells = self.cell - self.first_cell
+        occupancy = np.bincount(cells, minlength=self.last_cell - self.first_cell)
+        self.model.shared["occupancy"][self.first_cell:self.last_cell] = occupancy
+
+
+def run_worker(strip, params, seed, columns, strips, inboxes, barrier, spec, model_spec, connection):
+    """
+    Main loop of a worker process, steps its strip on every "step" message.
+    """
+    shared = SharedArrays.attach(spec)
+    model = SimpleNamespace(
+        profiler=None, seed_sequence=seed, people_version=0,
+        territory_labels=shared["territory_labels"] if "territory_labels" in shared else None,
+        shared=None if model_spec is None else SharedArrays.attach(model_spec),
+        **params
+    )
+
+    try:
+        population = TilePopulation(model, strip, strips, inboxes[strip], inboxes, barrier, shared["source_grids"])
+        population.add(*(columns[column] for column in COLUMNS))
+        while True:
+            message = connection.recv()
+            if message == "step":
+                population.step()
+                connection.send(("ok", (len(population), population.counts)))
+            elif message == "gather":
+                connection.send(("ok", {column: getattr(population, column) for column in COLUMNS}))
+            else:
+                break
+    except threading.BrokenBarrierError:
+        # Another worker failed, it is the one reporting why
+        connection.send(("broken", None))
+    except Exception:
+        barrier.abort()
+        connection.send(("error", traceback.format_exc()))
+
+
+class PartitionedPopulation:
+    """
+    Same role as VectorizedPopulation in the Simulation, with the people
+    split between worker processes (see the module docstring).
+    """
+
+    def __init__(self, model, partitions):
+        if partitions > model.width:
+            raise ValueError("partitions can not be more than the width of the grid")
+        self.model = model
+        self.partitions = partitions
+        self.strips = get_strips(model.width, partitions)
+        self.size = 0
+        self.workers = []
+        self.connections = []
+        self.barrier = None
+        self.shared = SharedArrays()
+
+    def __len__(self):
+        return self.size
+
+    def populate(self):
+        """
+        Creates the initial population like VectorizedPopulation and hands
+        every worker the people of its strip.
+        """
+        model = self.model
+        population = VectorizedPopulation(model)
+        population.populate()
+        self.size = len(population)
+        if model.shared is not None:
+            # The columns stay in the workers
+            for column in COLUMNS:
+                model.shared.release(column)
+            model.shared["size"][0] = 0
+
+        num_cells = model.width * model.height
+        self.shared.create("source_grids", (len(SOURCE_GROUPS), 2, num_cells + 1), np.float64)
+        if model.territory_labels is not None:
+            self.shared.share("territory_labels", model.territory_labels)
+        # Only the occupancy, the workers do not publish columns
+        model_spec = None
+        if model.shared is not None:
+            model_spec = {"occupancy": model.shared.spec()["occupancy"]}
+
+        context = multiprocessing.get_context()
+        inboxes = [context.Queue() for _ in range(self.partitions)]
+        barrier = self.barrier = context.Barrier(self.partitions)
+        params = {name: getattr(model, name) for name in MODEL_PARAMS}
+        seeds = model.seed_sequence.spawn(self.partitions)
+
+        strip_of_person = np.repeat(np.arange(self.partitions), np.diff(self.strips))[population.cell // model.height]
+        for strip in range(self.partitions):
+            mine = strip_of_person == strip
+            columns = {column: getattr(population, column)[mine] for column in COLUMNS}
+            connection, worker_connection = context.Pipe()
+            worker = context.Process(
+                target=run_worker,
+                args=(strip, params, seeds[strip], columns, self.strips, inboxes, barrier,
+                      self.shared.spec(), model_spec, worker_connection),
+                daemon=True,
+            )
+            worker.start()
+            # Only the worker keeps its end, so a dead worker means EOF here
+            worker_connection.close()
+            self.workers.append(worker)
+            self.connections.append(connection)
+
+        # Workers & shared memory go away with the population
+        weakref.finalize(self, close_workers, self.workers, self.connections, self.shared)
+
+    def step(self):
+        for connection in self.connections:
+            connection.send("step")
+
+        self.size = 0
+        type_counts = 0
+        territory_counts = None
+        for size, (worker_type_counts, worker_territory_counts) in self.receive():
+            self.size += size
+            type_counts = type_counts + worker_type_counts
+            if worker_territory_counts is not None:
+                territory_counts = worker_territory_counts + (0 if territory_counts is None else territory_counts)
+        set_counts(self.model, type_counts, territory_counts)
+
+    def gather(self):
+        """
+        Columns of the whole population, joined from every worker.
+        """
+        for connection in self.connections:
+            connection.send("gather")
+        parts = self.receive()
+        return {column: np.concatenate([part[column] for part in parts]) for column in COLUMNS}
+
+    def receive(self):
+        """
+        Answers of every worker, in order. Raises WorkerError (and closes the
+        workers) if one of them failed or died.
+        """
+        answers = []
+        failures = []
+        for strip, connection in enumerate(self.connections):
+            status, answer = self.wait(connection)
+            if status == "ok":
+                answers.append(answer)
+            elif status == "error":
+                failures.insert(0, "the worker of strip {} failed:\n{}".format(strip, answer))
+            elif status == "died":
+                failures.append("the worker of strip {} died (exit code {})".format(strip, self.workers[strip].exitcode))
+
+        if len(answers) < len(self.connections):
+            self.close()
+            raise WorkerError(failures[0] if failures else "a worker died")
+        return answers
+
+    def wait(self, connection):
+        """
+        Next message of connection, ("died", None) if its worker is dead. If
+        any worker is dead the barrier is broken, so the rest do not wait for it.
+        """
+        while not connection.poll(POLL_TIME):
+            if not all(worker.is_alive() for worker in self.workers):
+                self.barrier.abort()
+        try:
+            return connection.recv()
+        except (EOFError, OSError):
+            self.barrier.abort()
+            return "died", None
+
+    def close(self):
+        close_workers(self.workers, self.connections, self.shared)
+
+
+def close_workers(workers, connections, shared):
+    for connection in connections:
+        try:
+            connection.send("stop")
+        except (BrokenPipeError, OSError):
+            pass
+    for worker in workers:
+        worker.join(timeout=5)
+        if worker.is_alive():
+            worker.terminate()
+            worker.join()
+    workers.clear()
+    connections.clear()
+    shared.close()
@@ -0,0 +1,66 @@
+"""
+Per-phase timing of the simulation steps.
+
+A Simulation created with profile=True gets a StepProfiler in
+model.profiler, otherwise model.profiler is None and every timing point is
+skipped with a single `if profiler:` check.
+
+Phases of a tick:
+    moves & swap (synchronous mode), schedule, births_deaths, broadcast,
+    vectorized, patches, collect
+Phases inside the agent steps (part of schedule / vectorized):
+    movement, neighbors, ideas, demography, followers (broadcast of the
+    vectorized backend)
+"""
+
+from collections import defaultdict
+from time import perf_counter
+
+TICK_PHASES = ("moves", "schedule", "swap", "births_deaths", "broadcast", "vectorized", "patches", "collect")
+AGENT_PHASES = ("movement", "neighbors", "ideas", "demography", "followers")
+
+
+class StepProfiler:
+    """
+    Wall time and call count of every phase over a run.
+    """
+
+    def __init__(self):
+        self.time = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.ticks = 0
+        self.agents = 0
+        # Time spent stepping agents & patches, without collecting data
+        self.tick_time = 0.0
+        # Agents processed per second in the last tick
+        self.last_rate = 0.0
+
+    def lap(self, phase, start, calls=1):
+        """
+        Adds the time since start to phase, returns the current time for the next lap.
+        """
+        now = perf_counter()
+        self.time[phase] += now - start
+        self.calls[phase] += calls
+        return now
+
+    def tick(self, elapsed, agents):
+        self.ticks += 1
+        self.agents += agents
+        self.tick_time += elapsed
+        self.last_rate = agents / elapsed if elapsed else 0.0
+
+    def agents_per_second(self):
+        return self.agents / self.tick_time if self.tick_time else 0.0
+
+    def summary(self):
+        total = sum(self.time[phase] for phase in TICK_PHASES)
+        lines = [
+            "ticks= %d  time= %.3fs  agents/s= %.0f" % (self.ticks, total, self.agents_per_second()),
+            "%-14s %10s %7s %10s" % ("phase", "time (s)", "%", "calls"),
+        ]
+        for phase in TICK_PHASES + AGENT_PHASES:
+            if phase in self.calls:
+                share = 100 * self.time[phase] / total if total else 0.0
+                lines.append("%-14s %10.3f %7.1f %10d" % (phase, self.time[phase], share, self.calls[phase]))
+        return "\n".join(lines)
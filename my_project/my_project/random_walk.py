@@ -4,6 +4,8 @@ Generalized behavior for random walking, one grid cell at a time.
 
 import mesa
 
+from my_project.space import move_table
+
 
 class RandomWalker(mesa.Agent):
     """
@@ -34,8 +36,11 @@ class RandomWalker(mesa.Agent):
         """
         Step one cell in any allowable direction.
         """
-        # Pick the next cell from the adjacent cells.
-        next_moves = self.model.grid.get_neighborhood(self.pos, self.moore, True)
-        next_move = self.random.choice(next_moves)
+        # Pick the next cell from the adjacent cells, same pick as
+        # random.choice(grid.get_neighborhood(self.pos, self.moore, True))
+        grid = self.model.grid
+        table, count = move_table(grid.width, grid.height, False, self.moore, True)
+        cell = self.pos[0] * grid.height + self.pos[1]
+        next_move = int(table[cell, self.random.randrange(count[cell])])
         # Now move:
-        self.model.grid.move_agent(self, next_move)
+        grid.move_agent(self, (next_move // grid.height, next_move % grid.height))
@@ -0,0 +1,116 @@
+"""
+Raster visualization of the grid
+================================
+RasterGrid draws the same information as a CanvasGrid with person_portrayal,
+but instead of one portrayal dict per agent & patch it sends one 16 bit
+code per cell, and after the first frame only the cells whose code changed:
+
+    bits 0-1   party of the people in the cell (most of them), 0 if empty
+    bit  2     there is an influencer in the cell
+    bits 3-4   party controlling the territory of the cell
+    bits 5-15  territory id + 1, 0 without territories
+
+Parties use their PoliticalParty value (BLUE 1, GRAY 2, RED 3). Arrays are
+sent base64 encoded, drawn by resources/RasterModule.js.
+"""
+
+import base64
+import os
+
+import mesa
+import numpy as np
+
+from my_project.vectorized import party_index
+
+PEOPLE_BITS = 0
+INFLUENCER_BIT = 2
+TERRITORY_PARTY_BITS = 3
+TERRITORY_BITS = 5
+
+
+def encode(values, dtype):
+    return base64.b64encode(np.ascontiguousarray(values, dtype=dtype).tobytes()).decode("ascii")
+
+
+def get_people(model):
+    """
+    Cell, party code & is_influencer of every person and influencer of model.
+    """
+    population = model.population
+    if population is None:
+        agents = model.schedule.agents
+        height = model.height
+        cell = np.fromiter((a.pos[0] * height + a.pos[1] for a in agents), np.int64, len(agents))
+        party = np.fromiter((a.party for a in agents), np.int64, len(agents))
+        is_influencer = np.fromiter((a.is_influencer for a in agents), bool, len(agents))
+        return cell, party, is_influencer
+
+    if hasattr(population, "gather"):
+        columns = population.gather()
+    else:
+        columns = {"cell": population.cell, "inclination": population.inclination, "is_influencer": population.is_influencer}
+    return columns["cell"], party_index(columns["inclination"]) + 1, columns["is_influencer"]
+
+
+def get_territory_color(territory_id):
+    """
+    Gray shade of a territory: #222222, #444444, ... wrapping after #EEEEEE.
+    """
+    return "#" + ("%02X" % (((territory_id + 1) * 0x22) % 0x100)) * 3
+
+
+class RasterGrid(mesa.visualization.VisualizationElement):
+    """
+    Grid element that sends one code per cell, and only changes after the first frame.
+    """
+
+    local_includes = ["RasterModule.js"]
+    local_dir = os.path.join(os.path.dirname(__file__), "resources")
+
+    def __init__(self, grid_width, grid_height, canvas_width=500, canvas_height=500):
+        super().__init__()
+        self.grid_width = grid_width
+        self.grid_height = grid_height
+        self.js_code = "elements.push(new RasterModule({}, {}, {}, {}));".format(
+            canvas_width, canvas_height, grid_width, grid_height
+        )
+        # Model & raster of the last frame, a new model gets a full frame
+        self.model = None
+        self.raster = None
+        # Territory part of the codes and colors, fixed for a model
+        self.territory_codes = None
+        self.palette = []
+
+    def get_raster(self, model):
+        num_cells = model.width * model.height
+        if model is not self.model:
+            self.territory_codes = np.zeros(num_cells, dtype=np.uint16)
+            self.palette = []
+            if model.territory_labels is not None:
+                self.territory_codes = ((model.territory_labels + 1) << TERRITORY_BITS).astype(np.uint16)
+                self.palette = [get_territory_color(record.territory_id) for record in model.territories]
+
+        raster = self.territory_codes.copy()
+        if model.territory_labels is not None:
+            territory_party = np.array([record.political_party.value for record in model.territories], dtype=np.uint16)
+            raster |= territory_party[model.territory_labels] << TERRITORY_PARTY_BITS
+
+        cell, party, is_influencer = get_people(model)
+        if len(cell):
+            counts = np.bincount(cell * 3 + party - 1, minlength=num_cells * 3).reshape(num_cells, 3)
+            occupied = counts.any(axis=1)
+            raster[occupied] |= (counts[occupied].argmax(axis=1) + 1).astype(np.uint16) << PEOPLE_BITS
+            has_influencer = np.bincount(cell[is_influencer], minlength=num_cells) > 0
+            raster[has_influencer] |= 1 << INFLUENCER_BIT
+        return raster
+
+    def render(self, model):
+        raster = self.get_raster(model)
+        if model is not self.model or self.raster is None:
+            self.model = model
+            self.raster = raster
+            return {"full": encode(raster, "<u2"), "palette": self.palette}
+
+        changed = np.flatnonzero(raster != self.raster)
+        self.raster = raster
+        return {"cells": encode(changed, "<u4"), "values": encode(raster[changed], "<u2")}
@@ -0,0 +1,72 @@
+// Draws the frames of raster.RasterGrid: a full raster of cell codes, or the
+// cells that changed since the previous frame.
+const RasterModule = function (canvas_width, canvas_height, grid_width, grid_height) {
+  const canvas = document.createElement("canvas");
+  canvas.width = canvas_width;
+  canvas.height = canvas_height;
+  canvas.className = "world-grid";
+  const parent = document.createElement("div");
+  parent.style.height = canvas_height + "px";
+  parent.className = "world-grid-parent";
+  parent.appendChild(canvas);
+  document.getElementById("elements").appendChild(parent);
+
+  const context = canvas.getContext("2d");
+  const cellWidth = canvas_width / grid_width;
+  const cellHeight = canvas_height / grid_height;
+  // Index = PoliticalParty value
+  const PARTY_COLORS = [null, "#0000AA", "#9A9A9A", "#AA0000"];
+
+  let raster = new Uint16Array(grid_width * grid_height);
+  let palette = [];
+
+  const decode = (text, type) => {
+    const bytes = Uint8Array.from(atob(text), (c) => c.charCodeAt(0));
+    return new type(bytes.buffer);
+  };
+
+  const drawCell = (cell) => {
+    const value = raster[cell];
+    const people = value & 3;
+    const influencer = value & 4;
+    const territoryParty = (value >> 3) & 3;
+    const territory = value >> 5;
+
+    // y from the bottom, like the mesa grids
+    const left = Math.floor(cell / grid_height) * cellWidth;
+    const top = (grid_height - 1 - (cell % grid_height)) * cellHeight;
+
+    context.fillStyle = territory ? palette[territory - 1] : "#FFFFFF";
+    context.fillRect(left, top, cellWidth, cellHeight);
+    if (territoryParty === 1 || territoryParty === 3) {
+      context.strokeStyle = PARTY_COLORS[territoryParty];
+      context.strokeRect(left + 1, top + 1, cellWidth - 2, cellHeight - 2);
+    }
+    if (people) {
+      const radius = Math.min(cellWidth, cellHeight) * (influencer ? 0.45 : 0.3);
+      context.fillStyle = PARTY_COLORS[people];
+      context.beginPath();
+      context.arc(left + cellWidth / 2, top + cellHeight / 2, radius, 0, 2 * Math.PI);
+      context.fill();
+    }
+  };
+
+  this.render = (data) => {
+    if (data.full !== undefined) {
+      palette = data.palette;
+      raster = decode(data.full, Uint16Array);
+      for (let cell = 0; cell < raster.length; cell++) drawCell(cell);
+      return;
+    }
+    const cells = decode(data.cells, Uint32Array);
+    const values = decode(data.values, Uint16Array);
+    for (let i = 0; i < cells.length; i++) {
+      raster[cells[i]] = values[i];
+      drawCell(cells[i]);
+    }
+  };
+
+  this.reset = () => {
+    context.clearRect(0, 0, canvas_width, canvas_height);
+  };
+};
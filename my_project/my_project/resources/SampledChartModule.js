@@ -0,0 +1,19 @@
+// Chart of frames.SampledChartModule: every frame brings several points,
+// labeled with the step of the model they were collected at.
+const SampledChartModule = function (series, canvas_width, canvas_height) {
+  const chart = new ChartModule(series, canvas_width, canvas_height);
+
+  this.render = (data) => {
+    // ChartModule labels each point with control.tick
+    const tick = control.tick;
+    for (let i = 0; i < data.steps.length; i++) {
+      control.tick = data.steps[i];
+      chart.render(data.values[i]);
+    }
+    control.tick = tick;
+  };
+
+  this.reset = () => {
+    chart.reset();
+  };
+};
@@ -1,7 +1,9 @@
-from typing import Type, Callable
+from collections import defaultdict
+from typing import Type, Callable, List
 
 import mesa
 
+from my_project.tally import PartyTally
 
 class BaseActivationByTypeFiltered(mesa.time.BaseScheduler):
     """
@@ -14,8 +16,54 @@ class BaseActivationByTypeFiltered(mesa.time.BaseScheduler):
     Assumes that each agent added has a *step* method which takes no arguments.
 
     (This is explicitly meant to replicate the scheduler in MASON).
+
+    Agents added with active=False are counted but never stepped, for agents
+    whose state is set by others (e.g. the patches of a territory).
+
+    Like RandomActivationByType it keeps the agents of each type apart
+    (agents_by_type), so counting one type never walks the others.
     """
 
+    def __init__(self, model: mesa.Model) -> None:
+        super().__init__(model)
+        self.tally = PartyTally()
+        self.active = {}
+        self.agents_by_type = defaultdict(dict)
+
+    def add(self, agent: mesa.Agent, active: bool = True) -> None:
+        super().add(agent)
+        self.agents_by_type[type(agent)][agent.unique_id] = agent
+        if active:
+            self.active[agent.unique_id] = agent
+        self.tally.add(agent)
+
+    def remove(self, agent: mesa.Agent) -> None:
+        super().remove(agent)
+        del self.agents_by_type[type(agent)][agent.unique_id]
+        self.active.pop(agent.unique_id, None)
+        self.tally.remove(agent)
+
+    def add_many(self, agents: List[mesa.Agent], active: bool = True) -> None:
+        """
+        Adds all the agents at once, grouped by type.
+        """
+        by_type = defaultdict(dict)
+        for agent in agents:
+            by_type[type(agent)][agent.unique_id] = agent
+        for type_class, type_agents in by_type.items():
+            self._agents.update(type_agents)
+            self.agents_by_type[type_class].update(type_agents)
+            if active:
+                self.active.update(type_agents)
+        self.tally.add_many(agents)
+
+    def step(self) -> None:
+        """Execute the step of the active agents, one at a time."""
+        for agent in list(self.active.values()):
+            agent.step()
+        self.steps += 1
+        self.time += 1
+
     def get_type_count(
         self,
         type_class: Type[mesa.Agent],
@@ -23,13 +71,25 @@ class BaseActivationByTypeFiltered(mesa.time.BaseScheduler):
     ) -> int:
         """
         Returns the current number of agents of certain type in the queue that satisfy the filter function.
+
+        Without a filter the count is the size of the type's registry; counts
+        by party are kept by the tally, see get_party_count.
         """
+        type_agents = self.agents_by_type[type_class]
+        if filter_func is None:
+            return len(type_agents)
         count = 0
-        for agent in self.agents:
-            if filter_func is None or filter_func(agent):
+        for agent in type_agents.values():
+            if filter_func(agent):
                 count += 1
         return count
 
+    def get_party_count(self, type_class: Type[mesa.Agent], party=None) -> int:
+        """
+        Returns the current number of agents of certain type in the queue with the given political party.
+        """
+        return self.tally.count(type_class, party)
+
 class RandomActivationByTypeFiltered(mesa.time.RandomActivationByType):
     """
     A scheduler that overrides the get_type_count method to allow for filtering
@@ -38,8 +98,61 @@ class RandomActivationByTypeFiltered(mesa.time.RandomActivationByType):
     Example:
     >>> scheduler = RandomActivationByTypeFiltered(model)
     >>> scheduler.get_type_count(AgentA, lambda agent: agent.some_attribute > 10)
+
+    Counts by political party are kept up to date as agents are added, removed
+    or change party, so they are better read with `get_party_count`:
+    >>> scheduler.get_party_count(AgentA, PoliticalParty.RED)
+
+    Agents must not be added or removed while the schedule steps: births and
+    deaths are collected during the tick and applied at its end with
+    `add_many` / `remove_many`.
     """
 
+    def __init__(self, model: mesa.Model) -> None:
+        super().__init__(model)
+        self.tally = PartyTally()
+
+    def add(self, agent: mesa.Agent) -> None:
+        super().add(agent)
+        self.tally.add(agent)
+
+    def remove(self, agent: mesa.Agent) -> None:
+        super().remove(agent)
+        self.tally.remove(agent)
+
+    def add_many(self, agents: List[mesa.Agent]) -> None:
+        """
+        Adds all the agents at once, grouped by type.
+        """
+        by_type = defaultdict(dict)
+        for agent in agents:
+            by_type[type(agent)][agent.unique_id] = agent
+        for type_class, type_agents in by_type.items():
+            self._agents.update(type_agents)
+            self.agents_by_type[type_class].update(type_agents)
+        self.tally.add_many(agents)
+
+    def remove_many(self, agents: List[mesa.Agent]) -> None:
+        all_agents = self._agents
+        agents_by_type = self.agents_by_type
+        for agent in agents:
+            del all_agents[agent.unique_id]
+            del agents_by_type[type(agent)][agent.unique_id]
+        self.tally.remove_many(agents)
+
+    def step_type(self, type_class: Type[mesa.Agent], shuffle_agents: bool = True) -> None:
+        """
+        Shuffle order and run all agents of a given type.
+
+        Agents are not added or removed during the step, so they are stepped
+        straight from a list, without looking them up again.
+        """
+        agents = list(self.agents_by_type[type_class].values())
+        if shuffle_agents:
+            self.model.random.shuffle(agents)
+        for agent in agents:
+            agent.step()
+
     def get_type_count(
         self,
         type_class: Type[mesa.Agent],
@@ -47,9 +160,21 @@ class RandomActivationByTypeFiltered(mesa.time.RandomActivationByType):
     ) -> int:
         """
         Returns the current number of agents of certain type in the queue that satisfy the filter function.
+
+        Without a filter the count is the size of the type's registry; counts
+        by party are kept by the tally, see get_party_count.
         """
+        type_agents = self.agents_by_type[type_class]
+        if filter_func is None:
+            return len(type_agents)
         count = 0
-        for agent in self.agents_by_type[type_class].values():
-            if filter_func is None or filter_func(agent):
+        for agent in type_agents.values():
+            if filter_func(agent):
                 count += 1
         return count
+
+    def get_party_count(self, type_class: Type[mesa.Agent], party=None) -> int:
+        """
+        Returns the current number of agents of certain type in the queue with the given political party.
+        """
+        return self.tally.count(type_class, party)
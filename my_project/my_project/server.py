@@ -1,7 +1,10 @@
+from functools import lru_cache
+
 import mesa
 
 from my_project.agents import Person, Influencer, Territory, PoliticalParty
-from my_project.model import Simulation
+from my_project.frames import FrameServer, FrameSimulation, SampledChartModule
+from my_project.raster import RasterGrid, get_territory_color
 
 # To be able to use custom images as "Shape" grid should be CanvasGrid not Hex
 ## portrayal["Shape"] = "my_project/resources/republican.png"
@@ -43,33 +46,42 @@ def person_portrayal(agent):
         portrayal["Layer"] = 1
 
     elif type(agent) is Territory:
-        color_territory = "#" + str((agent.territory_id+1) * 2) * 6
-        if agent.political_party == PoliticalParty.RED:
-            portrayal["Color"] = [color_territory,color_territory,color_territory,"#AA0000"]
-            # portrayal["Color"] = ["#EE4C4E", "#A83638"]
-        elif agent.political_party == PoliticalParty.BLUE:
-            portrayal["Color"] = [color_territory,color_territory,color_territory, "#3369E8"]
-            # portrayal["Color"] = ["#3369E8", "#264EAB"]
-        else:
-            portrayal["Color"] = [color_territory]
-            # portrayal["Color"] = ["#9E9E9E","#00" + str((agent.territory_id+1) * 2) * 2 + "00"]
+        # Patches only change with the party of their territory
+        return dict(territory_portrayal(agent.territory_id, agent.political_party))
+
+    return portrayal
 
-        # portrayal["Color"] = ["#" + "FF" if agent.political_party == PoliticalParty.RED else "00" + str(agent.territory_id * 2) * 2 + "FF" if agent.political_party == PoliticalParty.BLUE else "00"]
-        # portrayal["Color"] = ["#00" + str((agent.territory_id+1) * 2) * 2 + "00"]
 
-        portrayal["Shape"] = "rect"
-        # portrayal["Shape"] = "hex"
-        portrayal["Filled"] = "true"
-        portrayal["r"] = 1
-        portrayal["w"] = 1
-        portrayal["h"] = 1
-        portrayal["Layer"] = 0
+@lru_cache(maxsize=None)
+def territory_portrayal(territory_id, political_party):
+    portrayal = {}
+    color_territory = get_territory_color(territory_id)
+    if political_party == PoliticalParty.RED:
+        portrayal["Color"] = [color_territory,color_territory,color_territory,"#AA0000"]
+        # portrayal["Color"] = ["#EE4C4E", "#A83638"]
+    elif political_party == PoliticalParty.BLUE:
+        portrayal["Color"] = [color_territory,color_territory,color_territory, "#3369E8"]
+        # portrayal["Color"] = ["#3369E8", "#264EAB"]
+    else:
+        portrayal["Color"] = [color_territory]
 
+    portrayal["Shape"] = "rect"
+    # portrayal["Shape"] = "hex"
+    portrayal["Filled"] = "true"
+    portrayal["r"] = 1
+    portrayal["w"] = 1
+    portrayal["h"] = 1
+    portrayal["Layer"] = 0
     return portrayal
 
-canvas_element = mesa.visualization.CanvasGrid(person_portrayal, 20, 20, 500, 500)
+
+# One portrayal per agent every frame, slow with big grids
+# canvas_element = mesa.visualization.CanvasGrid(person_portrayal, 20, 20, 500, 500)
 # canvas_element = mesa.visualization.CanvasHexGrid(person_portrayal, 20, 20, 500, 500)
-chart_element = mesa.visualization.ChartModule(
+# Only the cells that changed every frame
+canvas_element = RasterGrid(20, 20, 500, 500)
+# Every step run since the last frame, up to 10 points per frame
+chart_element = SampledChartModule(
     [
         {"Label": "Person", "Color": "#000000"},
         {"Label": "Influencer", "Color": "#888888"},
@@ -91,8 +103,15 @@ pie_element = mesa.visualization.PieChartModule(
 model_params = {
     # The following line is an example to showcase StaticText.
     "title": mesa.visualization.StaticText("Parameters:"),
+    "steps_per_frame": mesa.visualization.Slider(
+        "Steps per Frame", 1, 1, 100,
+        description="Steps the model runs for every frame drawn.",),
+    "frame_time": mesa.visualization.Slider(
+        "Seconds per Frame", 0, 0, 1, 0.05,
+        description="If not 0 the model runs in the background for this long every frame, instead of Steps per Frame.",),
     "is_hex": mesa.visualization.Checkbox("Hex Grid Enabled", False),
     "is_mortal": mesa.visualization.Checkbox("Enable Mortality", True),
+    "is_mobile": mesa.visualization.Checkbox("Enable Movement", True),
     "max_age": mesa.visualization.Slider(
         "Maximum Age", 80, 10, 100
     ),
@@ -114,13 +133,25 @@ model_params = {
     "person_reproduce": mesa.visualization.Slider(
         "Reproduction Rate", 0.04, 0.01, 1.0, 0.01
     ),
+    "carrying_capacity": mesa.visualization.Slider(
+        "Carrying Capacity", 0, 0, 5000, 50,
+        description="Most people alive at once, 0 for no limit.",),
+    "cell_capacity": mesa.visualization.Slider(
+        "People per Cell", 0, 0, 20,
+        description="No births in cells with this many people, 0 for no limit.",),
     "title_influencer": mesa.visualization.StaticText("Influencer Parameters:"),
     "enable_influencer": mesa.visualization.Checkbox("Influencer Enabled", True),
     "initial_influencer": mesa.visualization.Slider("Initial Influencer Population", 50, 10, 300),
     "influencer_influence": mesa.visualization.Slider("Influencer Influence", 0.3, 0.1, 1, 0.01),
+    "broadcast_influence": mesa.visualization.Slider(
+        "Media Reach", 0, 0, 1, 0.01,
+        description="How much the followers of an influencer move towards it every step, 0 disables it.",),
     "influencer_changes": mesa.visualization.Checkbox(
         "Influencer Consumes Ideas", True,
         description="Determines if Influencers will stay with their ideas or change.",),
+    "synchronous": mesa.visualization.Checkbox(
+        "Synchronous Update", False,
+        description="Influencers change their ideas all at once at the end of each step.",),
     "influencer_reproduce": mesa.visualization.Slider(
         "Influencer Reproduction Rate",
         0.07, 0.01, 1.0, 0.01,
@@ -128,7 +159,7 @@ model_params = {
     ),
 }
 
-server = mesa.visualization.ModularServer(
-    Simulation, [canvas_element, pie_element, chart_element], "Political Evolution Model", model_params
+server = FrameServer(
+    FrameSimulation, [canvas_element, pie_element, chart_element], "Political Evolution Model", model_params
 )
 server.port = 8521
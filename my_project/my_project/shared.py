@@ -0,0 +1,203 @@
+"""
+NumPy arrays living in multiprocessing.shared_memory blocks.
+
+The process that creates a SharedArrays owns the blocks; any process started
+from it with multiprocessing can attach to them with SharedArrays.attach(spec)
+and gets NumPy views of the same memory, nothing is pickled but the spec
+(block names, shapes & dtypes).
+
+With Simulation(shared_memory=True) the model keeps in model.shared:
+    occupancy         people in every cell (int32, width * height)
+    territory_labels  territory id of every cell, when there are territories
+    cell, inclination, age, influence, is_influencer, followers
+                      columns of the vectorized population, the first
+                      size[0] rows are valid, written at the end of every tick
+    size              number of valid rows of the columns
+
+The columns are created again, in new blocks, when the population outgrows
+them (see reserve), and the old blocks are unlinked. A process attached to
+them would keep reading the old ones, so the owner keeps a registry block
+(SharedArrays.register) with a generation counter, bumped every time an
+array is created or released, and the spec of the arrays. Readers attach
+with SharedArrays.attach_registry(model.shared.registry.name) and call
+refresh() before reading, which attaches again to whatever changed:
+
+    shared.refresh()
+    size = shared["size"][0]
+    cell = shared["cell"][:size]
+"""
+
+import json
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# Bytes of the registry block: the generation (int64) then the spec as JSON
+SPEC_SIZE = 1 << 16
+
+
+class SharedBlock(shared_memory.SharedMemory):
+    """
+    SharedMemory that can be closed while NumPy views of it are alive: the
+    memory is then unmapped when the last view goes away.
+    """
+
+    def close(self):
+        try:
+            super().close()
+        except BufferError:
+            pass
+
+
+class SharedArrays:
+    """
+    Named NumPy arrays backed by shared memory.
+    """
+
+    def __init__(self):
+        self.arrays = {}
+        self.blocks = {}
+        # Only the owner unlinks the blocks when closing
+        self.owner = True
+        # Generation & spec of the arrays, see register
+        self.registry = None
+        self.generation = 0
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def __contains__(self, name):
+        return name in self.arrays
+
+    def create(self, name, shape, dtype):
+        """
+        Creates (or replaces) the array name, filled with zeros.
+        """
+        dtype = np.dtype(dtype)
+        size = max(int(np.prod(shape)) * dtype.itemsize, 1)
+        block = SharedBlock(create=True, size=size)
+        self.drop(name)
+        self.blocks[name] = block
+        array = self.arrays[name] = view(block, shape, dtype)
+        array[...] = 0
+        self.write_registry()
+        return array
+
+    def share(self, name, values):
+        """
+        Creates the array name with a copy of values.
+        """
+        array = self.create(name, values.shape, values.dtype)
+        array[...] = values
+        return array
+
+    def reserve(self, name, length, dtype):
+        """
+        Makes sure the 1d array name holds at least length values. If it does
+        not it is created again (twice as long as needed, without the old
+        values) and attached processes must attach again, see refresh.
+        """
+        if name in self.arrays and len(self.arrays[name]) >= length:
+            return self.arrays[name]
+        return self.create(name, (max(2 * length, 16),), dtype)
+
+    def spec(self):
+        """
+        What another process needs to attach: name -> (block name, shape, dtype).
+        """
+        return {
+            name: (self.blocks[name].name, array.shape, array.dtype.str)
+            for name, array in self.arrays.items()
+        }
+
+    @classmethod
+    def attach(cls, spec):
+        shared = cls()
+        shared.owner = False
+        for name, (block_name, shape, dtype) in spec.items():
+            block = shared.blocks[name] = SharedBlock(name=block_name)
+            shared.arrays[name] = view(block, shape, dtype)
+        return shared
+
+    def register(self):
+        """
+        Creates the registry block of the owner, see the module docstring.
+        """
+        self.registry = SharedBlock(create=True, size=8 + SPEC_SIZE)
+        self.write_registry()
+
+    def write_registry(self):
+        if self.registry is None or not self.owner:
+            return
+        spec = json.dumps(self.spec()).encode()
+        if len(spec) > SPEC_SIZE:
+            raise ValueError("too many shared arrays for the registry")
+        # The spec first, readers only look at it once the generation changes
+        self.registry.buf[8:8 + SPEC_SIZE] = spec.ljust(SPEC_SIZE)
+        self.generation += 1
+        view(self.registry, (1,), np.int64)[0] = self.generation
+
+    @classmethod
+    def attach_registry(cls, registry_name):
+        """
+        Attaches to every array of the owner of the registry block registry_name.
+        """
+        shared = cls()
+        shared.owner = False
+        shared.registry = SharedBlock(name=registry_name)
+        shared.refresh()
+        return shared
+
+    def refresh(self):
+        """
+        Attaches again to the arrays created or released by the owner since
+        the last call (readers of attach_registry). Returns whether any changed.
+        """
+        generation = int(view(self.registry, (1,), np.int64)[0])
+        if generation == self.generation:
+            return False
+        spec = json.loads(bytes(self.registry.buf[8:8 + SPEC_SIZE]).decode())
+        for name in list(self.blocks):
+            if name not in spec or spec[name][0] != self.blocks[name].name:
+                self.drop(name)
+        for name, (block_name, shape, dtype) in spec.items():
+            if name not in self.blocks:
+                block = self.blocks[name] = SharedBlock(name=block_name)
+                self.arrays[name] = view(block, shape, dtype)
+        self.generation = generation
+        return True
+
+    def release(self, name):
+        self.drop(name)
+        self.write_registry()
+
+    def drop(self, name):
+        if name not in self.blocks:
+            return
+        del self.arrays[name]
+        block = self.blocks.pop(name)
+        block.close()
+        if self.owner:
+            block.unlink()
+
+    def close(self):
+        for name in list(self.blocks):
+            self.drop(name)
+        if self.registry is not None:
+            self.registry.close()
+            if self.owner:
+                self.registry.unlink()
+            self.registry = None
+
+    def __del__(self):
+        self.close()
+
+
+def view(block, shape, dtype):
+    """
+    NumPy view of a block. It holds the memory exported, so the block can not
+    be closed (unmapped) while the view is alive.
+    """
+    dtype = np.dtype(dtype)
+    count = int(np.prod(shape))
+    return np.frombuffer(block.buf, dtype, count).reshape(shape)
@@ -0,0 +1,79 @@
+"""
+Streaming output for the model reporters.
+
+StreamingDataCollector keeps at most chunk_size steps of the model reporters
+in memory. Every full chunk is turned into a NumPy record array (one typed
+column per reporter) and appended to a .npy stream file, so memory stays
+constant however many steps are run. load_series reads the whole file back.
+"""
+
+import os
+
+import mesa
+import numpy as np
+import pandas as pd
+
+
+def load_series(path):
+    """
+    Reads back the file written by a StreamingDataCollector as a DataFrame,
+    one row per collected step.
+    """
+    chunks = []
+    if os.path.exists(path):
+        size = os.path.getsize(path)
+        with open(path, "rb") as stream:
+            while stream.tell() < size:
+                chunks.append(np.load(stream))
+    if not chunks:
+        return pd.DataFrame()
+    return pd.DataFrame(np.concatenate(chunks))
+
+
+class StreamingDataCollector(mesa.DataCollector):
+    """
+    DataCollector for model reporters that flushes them to path every chunk_size steps.
+
+    model_vars only holds the steps not flushed yet (and always the last
+    value, which is what the charts read).
+    """
+
+    def __init__(self, model_reporters, path, chunk_size=1000, append=False):
+        super().__init__(model_reporters)
+        self.path = path
+        self.chunk_size = chunk_size
+        # Values at the start of model_vars that were already written
+        self.written = 0
+        # Start a new file (unless continuing one), chunks are appended from here on
+        if not append:
+            open(self.path, "wb").close()
+
+    def collect(self, model):
+        super().collect(model)
+        if self.pending() >= self.chunk_size:
+            self.flush()
+
+    def pending(self):
+        if not self.model_vars:
+            return 0
+        return len(next(iter(self.model_vars.values()))) - self.written
+
+    def flush(self):
+        """
+        Appends the values collected since the last flush to the file.
+        """
+        if self.pending() <= 0:
+            return
+
+        columns = [np.asarray(values[self.written:]) for values in self.model_vars.values()]
+        chunk = np.rec.fromarrays(columns, names=list(self.model_vars))
+        with open(self.path, "ab") as stream:
+            np.save(stream, chunk)
+
+        for name, values in self.model_vars.items():
+            self.model_vars[name] = values[-1:]
+        self.written = 1
+
+    def get_model_vars_dataframe(self):
+        self.flush()
+        return load_series(self.path)
@@ -0,0 +1,375 @@
+"""
+Precomputed neighborhoods for the torus grids of the simulation.
+
+Cells are numbered the same way the mesa grids store them:
+
+    cell = x * height + y
+"""
+
+import functools
+from itertools import chain
+
+import numpy as np
+
+# Adjacent cells on an odd-q hex grid, as in mesa.space.HexGrid
+HEX_ADJACENT = (
+    # x even
+    ((0, -1), (0, 1), (-1, 1), (-1, 0), (1, 1), (1, 0)),
+    # x odd
+    ((0, -1), (0, 1), (-1, 0), (-1, -1), (1, 0), (1, -1)),
+)
+
+
+@functools.lru_cache(maxsize=None)
+def neighborhood_offsets(radius, include_center=True):
+    """
+    (dx, dy) offsets of the Moore neighborhood of a cell of a square grid.
+    """
+    offsets = [
+        (dx, dy)
+        for dx in range(-radius, radius + 1)
+        for dy in range(-radius, radius + 1)
+    ]
+    if not include_center:
+        offsets.remove((0, 0))
+    return tuple(offsets)
+
+
+def neighborhood_table(width, height, radius, is_hex=False, include_center=True):
+    """
+    Array of shape (width * height, k) with the cell ids of the neighborhood
+    of every cell.
+
+    When the torus is small enough for a neighborhood to wrap onto itself the
+    repeated cells are replaced by width * height and moved to the end of the
+    row, so arrays indexed by the table need one extra (empty) trailing slot.
+    """
+    if is_hex:
+        return hex_neighborhood_table(width, height, radius, include_center)
+
+    num_cells = width * height
+    x = np.arange(num_cells) // height
+    y = np.arange(num_cells) % height
+
+    offsets = np.array(neighborhood_offsets(radius, include_center))
+    nx = (x[:, None] + offsets[:, 0]) % width
+    ny = (y[:, None] + offsets[:, 1]) % height
+    table = nx * height + ny
+
+    if width <= 2 * radius or height <= 2 * radius:
+        table = drop_repeated(table, num_cells)
+    return table
+
+
+def hex_neighborhood_table(width, height, radius, include_center=True):
+    """
+    neighborhood_table of a hex grid, grown ring by ring from the adjacent
+    cells of every cell like HexGrid.get_neighborhood (same cells, sorted).
+    The parity of a cell is that of its wrapped x, so an odd width works too.
+    """
+    num_cells = width * height
+    x = np.arange(num_cells) // height
+    y = np.arange(num_cells) % height
+
+    # One extra row, so the padding of the table stays padding
+    adjacent = np.full((num_cells + 1, 6), num_cells, dtype=np.int64)
+    for parity in (0, 1):
+        rows = np.flatnonzero(x % 2 == parity)
+        offsets = np.array(HEX_ADJACENT[parity])
+        nx = (x[rows, None] + offsets[:, 0]) % width
+        ny = (y[rows, None] + offsets[:, 1]) % height
+        adjacent[rows] = nx * height + ny
+
+    table = np.arange(num_cells)[:, None]
+    for _ in range(radius):
+        table = drop_repeated(np.concatenate([table, adjacent[table].reshape(num_cells, -1)], axis=1), num_cells)
+
+    if not include_center:
+        table = table.copy()
+        table[table == np.arange(num_cells)[:, None]] = num_cells
+        table = drop_repeated(table, num_cells)
+    return table
+
+
+def drop_repeated(table, padding):
+    """
+    Sorts every row of table, replaces the repeated cells by padding (moved
+    to the end of the row) and drops the columns that are only padding.
+    """
+    table = np.sort(table, axis=1)
+    repeated = np.zeros(table.shape, dtype=bool)
+    repeated[:, 1:] = table[:, 1:] == table[:, :-1]
+    table[repeated] = padding
+    table.sort(axis=1)
+    k = (table < padding).sum(axis=1).max(initial=0)
+    return table[:, :k]
+
+
+def get_moves(x, y, width, height, is_hex=False, moore=True, include_center=False):
+    """
+    Cells one step away from (x, y) on a torus, in the same order as
+    get_neighborhood of the mesa grids (radius 1), so picking one with
+    random.choice gives the same cell.
+    """
+    if is_hex:
+        adjacent = HEX_ADJACENT[x % 2]
+        moves = {((x + dx) % width, (y + dy) % height) for dx, dy in adjacent}
+        if include_center:
+            moves.add((x, y))
+        else:
+            moves.discard((x, y))
+        return sorted(moves)
+
+    # Like MultiGrid, a neighborhood as wide as the grid does not repeat cells
+    x_radius, y_radius = min(1, width // 2), min(1, height // 2)
+    kx = int(x_radius == width // 2 and width % 2 == 0)
+    ky = int(y_radius == height // 2 and height % 2 == 0)
+    moves = [
+        ((x + dx) % width, (y + dy) % height)
+        for dx in range(-x_radius, x_radius + 1 - kx)
+        for dy in range(-y_radius, y_radius + 1 - ky)
+        if moore or abs(dx) + abs(dy) <= 1
+    ]
+    if not include_center:
+        moves.remove((x, y))
+    return moves
+
+
+@functools.lru_cache(maxsize=None)
+def move_table(width, height, is_hex=False, moore=True, include_center=False):
+    """
+    Moves of every cell (see get_moves) as cell ids: array of shape
+    (width * height, k) padded with width * height, and the number of moves
+    of every cell.
+    """
+    num_cells = width * height
+    rows = [
+        [mx * height + my for mx, my in get_moves(x, y, width, height, is_hex, moore, include_center)]
+        for x in range(width)
+        for y in range(height)
+    ]
+    count = np.array([len(row) for row in rows], dtype=np.int64)
+    table = np.full((num_cells, count.max()), num_cells, dtype=np.int64)
+    for cell, row in enumerate(rows):
+        table[cell, :len(row)] = row
+    return table, count
+
+
+def cell_id(pos, height):
+    x, y = pos
+    return x * height + y
+
+
+def cell_pos(cell, height):
+    return (int(cell // height), int(cell % height))
+
+
+class SpatialIndex:
+    """
+    People and territory patches of every cell, kept by the model next to
+    the mesa grid so neighbor queries never have to filter out patches.
+
+    Agents must be placed, moved and removed through the index, which keeps
+    the grid in sync.
+    """
+
+    def __init__(self, grid, is_hex=False):
+        self.grid = grid
+        self.width = grid.width
+        self.height = grid.height
+        self.is_hex = is_hex
+        self.num_cells = self.width * self.height
+
+        # Empty cells share the same tuple instead of holding a list each
+        self.people = [()] * self.num_cells
+        self.patches = [None] * self.num_cells
+        # TerritoryRecord of each cell, its residents are counted as they come & go
+        self.territory_of = [None] * self.num_cells
+
+        # People in every cell, kept only when set to an array (shared state)
+        self.occupancy = None
+
+        # radius -> neighborhood table & the rows already turned into tuples
+        self.tables = {}
+        self.neighborhoods = {}
+        # radius -> people in the neighborhood of every cell, None until asked
+        # for or after a change in any cell of the neighborhood. Only kept
+        # with cache_people: when everyone moves every tick cleaning costs
+        # more than the hits save
+        self.cache_people = False
+        self.people_near = {}
+        # Cells whose people changed since the caches were last cleaned
+        self.dirty = set()
+        # Moves of Person.random_move, the same ones grid.get_neighborhood(pos, True)
+        # gives: Moore without the center, hex with it
+        self.move_table = None
+        self.move_count = None
+        self.moves = [None] * self.num_cells
+
+    def cell(self, pos):
+        x, y = pos
+        return x * self.height + y
+
+    def place_agent(self, agent, pos):
+        self.grid.place_agent(agent, pos)
+        self._add(agent, self.cell(pos))
+
+    def remove_agent(self, agent):
+        self._remove(agent, self.cell(agent.pos))
+        self.grid.remove_agent(agent)
+
+    def move_agent(self, agent, pos):
+        self._remove(agent, self.cell(agent.pos))
+        self.grid.move_agent(agent, pos)
+        self._add(agent, self.cell(agent.pos))
+
+    def move_many(self, agents, cells):
+        """
+        Moves every agent to its cell id in cells.
+        """
+        grid = self.grid
+        height = self.height
+        for agent, cell in zip(agents, cells):
+            old_cell = self.cell(agent.pos)
+            if cell == old_cell:
+                continue
+            self._remove(agent, old_cell)
+            grid.move_agent(agent, (cell // height, cell % height))
+            self._add(agent, cell)
+
+    def place_many(self, agents):
+        """
+        Places every agent in its own pos.
+        """
+        grid = self.grid
+        for agent in agents:
+            grid.place_agent(agent, agent.pos)
+            self._add(agent, self.cell(agent.pos))
+
+    def remove_many(self, agents):
+        grid = self.grid
+        for agent in agents:
+            self._remove(agent, self.cell(agent.pos))
+            grid.remove_agent(agent)
+
+    def place_patch(self, patch, pos):
+        self.grid.place_agent(patch, pos)
+        cell = self.cell(pos)
+        self.patches[cell] = patch
+        self.territory_of[cell] = patch.record
+
+    def party_changed(self, agent, old_party, new_party):
+        record = self.territory_of[self.cell(agent.pos)]
+        if record is not None:
+            record.change_party(old_party, new_party)
+
+    def _add(self, agent, cell):
+        people = self.people[cell]
+        if people:
+            people.append(agent)
+        else:
+            self.people[cell] = [agent]
+        if self.cache_people:
+            self.dirty.add(cell)
+        if self.occupancy is not None:
+            self.occupancy[cell] += 1
+
+        record = self.territory_of[cell]
+        if record is not None:
+            record.add_person(agent.political_party)
+
+    def _remove(self, agent, cell):
+        people = self.people[cell]
+        people.remove(agent)
+        if not people:
+            self.people[cell] = ()
+        if self.cache_people:
+            self.dirty.add(cell)
+        if self.occupancy is not None:
+            self.occupancy[cell] -= 1
+
+        record = self.territory_of[cell]
+        if record is not None:
+            record.remove_person(agent.political_party)
+
+    def get_patch(self, pos):
+        return self.patches[self.cell(pos)]
+
+    def get_cell_people(self, pos):
+        return self.people[self.cell(pos)]
+
+    def get_neighborhood(self, cell, radius):
+        """
+        Cell ids of the neighborhood of cell (including itself), cached per radius.
+        """
+        neighborhoods = self.neighborhoods.get(radius)
+        if neighborhoods is None:
+            self.tables[radius] = neighborhood_table(self.width, self.height, radius, self.is_hex)
+            neighborhoods = self.neighborhoods[radius] = [None] * self.num_cells
+
+        neighborhood = neighborhoods[cell]
+        if neighborhood is None:
+            row = self.tables[radius][cell]
+            neighborhood = neighborhoods[cell] = tuple(row[row < self.num_cells].tolist())
+        return neighborhood
+
+    def get_move_table(self):
+        if self.move_table is None:
+            self.move_table, self.move_count = move_table(
+                self.width, self.height, self.is_hex, include_center=self.is_hex
+            )
+        return self.move_table, self.move_count
+
+    def get_moves(self, cell):
+        """
+        Positions one step away from cell, cached as tuples.
+        """
+        moves = self.moves[cell]
+        if moves is None:
+            table, count = self.get_move_table()
+            height = self.height
+            moves = self.moves[cell] = tuple(
+                (move // height, move % height) for move in table[cell, :count[cell]].tolist()
+            )
+        return moves
+
+    def iter_people(self, pos, radius):
+        """
+        Persons and influencers in the neighborhood of pos.
+        """
+        if self.cache_people:
+            return self.get_people_near(self.cell(pos), radius)
+        people = self.people
+        return chain.from_iterable(people[cell] for cell in self.get_neighborhood(self.cell(pos), radius))
+
+    def get_people_near(self, cell, radius):
+        """
+        Tuple of the people in the neighborhood of cell, in the order of the
+        neighborhood. Cached per cell & radius until people come or go in
+        any cell of the neighborhood.
+        """
+        if self.dirty:
+            self.clean()
+        cache = self.people_near.get(radius)
+        if cache is None:
+            cache = self.people_near[radius] = [None] * self.num_cells
+
+        near = cache[cell]
+        if near is None:
+            people = self.people
+            near = cache[cell] = tuple(
+                chain.from_iterable(people[neighbor] for neighbor in self.get_neighborhood(cell, radius))
+            )
+        return near
+
+    def clean(self):
+        """
+        Forgets the cached people of every neighborhood containing a dirty cell.
+        """
+        # Neighborhoods are symmetric: the ones containing a cell are the
+        # ones around it
+        for radius, cache in self.people_near.items():
+            for cell in self.dirty:
+                for center in self.get_neighborhood(cell, radius):
+                    cache[center] = None
+        self.dirty.clear()
@@ -0,0 +1,56 @@
+"""
+Party tallies kept current by the schedulers.
+
+Instead of walking every agent with a filter each time we want to know how
+many Republicans there are, the schedulers keep one counter per
+(agent type, political party) and update it as agents are added, removed
+or change party.
+"""
+
+from collections import Counter, defaultdict
+
+
+class PartyTally:
+    """
+    Counts of agents by type and political party.
+
+    Agents reach the tally of the scheduler they were added to through their
+    model and report every party change through `change`.
+    """
+
+    def __init__(self):
+        self.counts = defaultdict(Counter)
+
+    def add(self, agent):
+        self.counts[type(agent)][agent.political_party] += 1
+
+    def remove(self, agent):
+        self.counts[type(agent)][agent.political_party] -= 1
+
+    def add_many(self, agents):
+        for agent in agents:
+            self.counts[type(agent)][agent.political_party] += 1
+
+    def remove_many(self, agents):
+        for agent in agents:
+            self.counts[type(agent)][agent.political_party] -= 1
+
+    def change(self, agent, old_party, new_party):
+        counts = self.counts[type(agent)]
+        counts[old_party] -= 1
+        counts[new_party] += 1
+
+    def set_counts(self, type_class, counts):
+        """
+        Replaces the counts of type_class, for agents that are not stepped one by one.
+        """
+        self.counts[type_class] = Counter(counts)
+
+    def count(self, type_class, party=None):
+        """
+        Returns the number of agents of type_class, only those of party if given.
+        """
+        counts = self.counts[type_class]
+        if party is None:
+            return sum(counts.values())
+        return counts[party]
@@ -0,0 +1,93 @@
+"""
+Territories: partitioning the grid between capitals and keeping territory
+control up to date incrementally.
+
+Every territory has one TerritoryRecord shared by all of its patches. The
+spatial index updates the record's resident counts as people move between
+cells, are born, die or change party, so finding the party that controls a
+territory no longer needs to walk its cells.
+"""
+
+import numpy as np
+
+from my_project.agents import PoliticalParty
+from my_project.space import neighborhood_table
+
+
+def partition_territories(width, height, capitals, is_hex=False):
+    """
+    Assigns every cell of the torus to its closest capital with a breadth
+    first search started from all the capitals at once, so every cell is
+    visited a single time.
+
+    Distances are measured in Moore (or hex) steps and ties go to the capital
+    listed first, the same result as growing the capitals ring by ring in turn.
+
+    Returns an array with the territory id (index in capitals) of every cell.
+    """
+    num_cells = width * height
+    adjacent = neighborhood_table(width, height, 1, is_hex, include_center=False)
+
+    labels = np.full(num_cells, -1, dtype=np.int64)
+    frontier = np.array([x * height + y for x, y in capitals], dtype=np.int64)
+    labels[frontier] = np.arange(len(capitals))
+
+    while len(frontier):
+        cells = adjacent[frontier].ravel()
+        cell_labels = np.repeat(labels[frontier], adjacent.shape[1])
+
+        free = cells < num_cells
+        cells, cell_labels = cells[free], cell_labels[free]
+        free = labels[cells] == -1
+        cells, cell_labels = cells[free], cell_labels[free]
+
+        # Cells reached by several territories go to the lowest territory id
+        order = np.lexsort((cell_labels, cells))
+        frontier, first = np.unique(cells[order], return_index=True)
+        labels[frontier] = cell_labels[order][first]
+
+    return labels
+
+
+class TerritoryRecord:
+    """
+    Residents by party and controlling party of one territory.
+    """
+
+    def __init__(self, territory_id, capital):
+        self.territory_id = territory_id
+        self.capital = capital
+        self.patches = []
+        # in order [BLUE, GRAY, RED] or [democrat, none, republican]
+        self.population_party = {PoliticalParty.BLUE: 0, PoliticalParty.GRAY: 0, PoliticalParty.RED: 0}
+        self.political_party = PoliticalParty.GRAY
+
+    def add_patch(self, patch):
+        self.patches.append(patch)
+
+    def add_person(self, party):
+        self.population_party[party] += 1
+
+    def remove_person(self, party):
+        self.population_party[party] -= 1
+
+    def change_party(self, old_party, new_party):
+        self.population_party[old_party] -= 1
+        self.population_party[new_party] += 1
+
+    def set_counts(self, population_party):
+        self.population_party = population_party
+
+    def get_party(self):
+        population_party = self.population_party
+        return max(population_party, key=lambda k: population_party[k])
+
+    def update(self):
+        """
+        Recomputes the controlling party, the patches are only touched when it changes.
+        """
+        party = self.get_party()
+        if party is not self.political_party:
+            self.political_party = party
+            for patch in self.patches:
+                patch.set_party(party)
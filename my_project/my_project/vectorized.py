@@ -0,0 +1,354 @@
+"""
+Array backed engine for the political dynamics of persons and influencers.
+
+Instead of one Person agent per citizen, the population is stored as NumPy
+columns (cell, inclination, age, influence radius, is_influencer) and every
+phase of Person.step is applied to the whole population at once:
+
+    age -> move -> influencers consume ideas -> reproduce & die
+        -> followers hear the influencers (broadcast.py) -> party
+
+The result is statistically equivalent to stepping Person agents one at a
+time, not identical: agents are activated in random order there, so every
+influencer absorbs the ideas of its neighbors one after the other. Here that
+sequence is replaced by its average over activation orders,
+
+    x' = R * x + (1 - R) * mean(x_a)
+
+where R is the product of (1 - f_a) over the neighbors a, f_a is the weight
+consumes_ideas gives to each of them and mean(x_a) is weighted by f_a.
+
+Inclinations are read before any of them changes, this is exactly the
+update of the agents in synchronous mode (Simulation(synchronous=True)).
+"""
+
+from time import perf_counter
+
+import numpy as np
+
+from my_project.agents import Person, Influencer, PoliticalParty
+from my_project.space import neighborhood_table
+from my_project.broadcast import FollowerNetwork
+
+PERSON_RADIUS = Person.influence
+INFLUENCER_RADIUS = Influencer.influence
+
+PARTIES = (PoliticalParty.BLUE, PoliticalParty.GRAY, PoliticalParty.RED)
+
+# Attributes of every person, one array each
+COLUMNS = ("cell", "inclination", "age", "influence", "is_influencer", "followers")
+
+# Followers of a newborn influencer, same as Influencer
+NEWBORN_FOLLOWERS = 100
+
+# Groups of people whose ideas are shared with the same radius & weight
+SOURCE_GROUPS = tuple(
+    (radius, is_influencer) for radius in (PERSON_RADIUS, INFLUENCER_RADIUS) for is_influencer in (False, True)
+)
+
+
+def party_index(inclination):
+    """
+    Index in PARTIES of each inclination, same thresholds as PoliticalAgent.get_party.
+    """
+    return np.sign(inclination.astype(np.int64) - 128) + 1
+
+
+class VectorizedPopulation:
+    """
+    All the persons and influencers of a Simulation as NumPy arrays.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.rng = np.random.default_rng(model.seed_sequence.spawn(1)[0])
+        self.num_cells = model.width * model.height
+
+        self.cell = np.zeros(0, dtype=np.int64)
+        self.inclination = np.zeros(0, dtype=np.int16)
+        # Not int16: with is_mortal=False it would wrap after 32767 steps
+        self.age = np.zeros(0, dtype=np.int32)
+        self.influence = np.zeros(0, dtype=np.int8)
+        self.is_influencer = np.zeros(0, dtype=bool)
+        # Only drawn with broadcast_influence, 0 for persons
+        self.followers = np.zeros(0, dtype=np.int32)
+        self.network = FollowerNetwork() if model.broadcast_influence else None
+        # Never reused, the follower network knows the people by it
+        self.key = np.zeros(0, dtype=np.int64)
+        self.next_key = 0
+
+        # Moves allowed from each cell, same as Person.random_move
+        self.move_table = neighborhood_table(
+            model.width, model.height, 1, model.is_hex, include_center=model.is_hex
+        )
+        self.move_count = (self.move_table < self.num_cells).sum(axis=1)
+        self.tables = {}
+
+
+    def __len__(self):
+        return len(self.cell)
+
+    def add(self, cell, inclination, age, influence, is_influencer, followers):
+        self.cell = np.concatenate([self.cell, cell])
+        self.inclination = np.concatenate([self.inclination, np.asarray(inclination, dtype=np.int16)])
+        self.age = np.concatenate([self.age, np.asarray(age, dtype=np.int32)])
+        self.influence = np.concatenate([self.influence, np.asarray(influence, dtype=np.int8)])
+        self.is_influencer = np.concatenate([self.is_influencer, is_influencer])
+        self.followers = np.concatenate([self.followers, np.asarray(followers, dtype=np.int32)])
+        self.key = np.concatenate([self.key, np.arange(self.next_key, self.next_key + len(cell))])
+        self.next_key += len(cell)
+        if len(cell):
+            self.model.people_version += 1
+
+    def remove(self, mask):
+        keep = ~mask
+        self.cell = self.cell[keep]
+        self.inclination = self.inclination[keep]
+        self.age = self.age[keep]
+        self.influence = self.influence[keep]
+        self.is_influencer = self.is_influencer[keep]
+        self.followers = self.followers[keep]
+        self.key = self.key[keep]
+        if mask.any():
+            self.model.people_version += 1
+
+    def populate(self):
+        """
+        Creates the initial population, same parameters as the agents of Simulation.__init__.
+        """
+        model = self.model
+        self.create(model.initial_person, PERSON_RADIUS, False)
+        if model.enable_influencer:
+            self.create(model.initial_influencer, INFLUENCER_RADIUS, True)
+        self.update_counts()
+
+    def create(self, n, influence, is_influencer):
+        model = self.model
+        x = self.rng.integers(model.width, size=n)
+        y = self.rng.integers(model.height, size=n)
+        inclination = np.where(np.arange(n) < n * model.initial_percentage, 256, 0)
+        age = self.rng.integers(model.max_age, size=n)
+        followers = np.zeros(n)
+        if is_influencer and self.network is not None:
+            followers = self.rng.integers(1000, size=n)
+        self.add(x * model.height + y, inclination, age, np.full(n, influence), np.full(n, is_influencer), followers)
+
+    def get_table(self, radius):
+        if radius not in self.tables:
+            model = self.model
+            self.tables[radius] = neighborhood_table(model.width, model.height, radius, model.is_hex)
+        return self.tables[radius]
+
+    def step(self):
+        model = self.model
+        profiler = model.profiler
+        if profiler:
+            start = perf_counter()
+
+        self.age += 1
+        if model.is_mobile:
+            self.random_move()
+        if profiler:
+            start = profiler.lap("movement", start, len(self))
+
+        if model.influencer_changes:
+            self.share_ideas()
+        if profiler:
+            start = profiler.lap("ideas", start, len(self))
+
+        if model.is_mortal:
+            self.reproduce_and_die()
+        if profiler:
+            start = profiler.lap("demography", start, len(self))
+
+        if self.network is not None:
+            self.broadcast()
+            if profiler:
+                start = profiler.lap("followers", start, len(self))
+        self.update_counts()
+
+    def random_move(self):
+        choice = (self.rng.random(len(self)) * self.move_count[self.cell]).astype(np.int64)
+        self.cell = self.move_table[self.cell, choice]
+
+    def share_ideas(self):
+        """
+        Every influencer consumes the ideas of the people whose neighborhood
+        it is in (Person.share_ideas -> Influencer.consumes_ideas).
+        """
+        consumers = np.flatnonzero(self.is_influencer)
+        if len(consumers) == 0:
+            return
+        self.consume_ideas(consumers, self.get_source_grids())
+
+    def get_source_grids(self):
+        """
+        Number of people and sum of their inclinations in every cell, for
+        every group of SOURCE_GROUPS: array of shape (groups, 2, cells + 1).
+        """
+        grids = np.zeros((len(SOURCE_GROUPS), 2, self.num_cells + 1))
+        for i, (radius, source_is_influencer) in enumerate(SOURCE_GROUPS):
+            sources = (self.influence == radius) & (self.is_influencer == source_is_influencer)
+            cells = self.cell[sources]
+            grids[i, 0] = np.bincount(cells, minlength=self.num_cells + 1)
+            grids[i, 1] = np.bincount(cells, weights=self.inclination[sources], minlength=self.num_cells + 1)
+        return grids
+
+    def consume_ideas(self, consumers, grids):
+        """
+        Updates the inclination of the consumers from the source grids.
+        """
+        model = self.model
+        x = self.inclination[consumers].astype(np.float64)
+        age = self.age[consumers]
+        age_factor = np.where(age < 18, 1.25, np.where(age > 50, .75, 1.0))
+
+        retention = np.ones(len(consumers))
+        weight_total = np.zeros(len(consumers))
+        weighted_sum = np.zeros(len(consumers))
+
+        # Sources are grouped by influence radius and by being influencers
+        for (radius, source_is_influencer), (count_grid, sum_grid) in zip(SOURCE_GROUPS, grids):
+            if not count_grid.any():
+                continue
+            table = self.get_table(radius)[self.cell[consumers]]
+            weight = 1 + model.influencer_influence if source_is_influencer else 1
+
+            count = count_grid[table].sum(axis=1)
+            total = sum_grid[table].sum(axis=1)
+            # The influencer does not consume its own ideas
+            is_self = (self.influence[consumers] == radius) & (self.is_influencer[consumers] == source_is_influencer)
+            count -= is_self
+            total -= is_self * x
+
+            factor = 1 - model.proximity_influence * weight * age_factor
+            retention *= np.power(factor, count)
+            weight_total += weight * count
+            weighted_sum += weight * total
+
+        heard = weight_total > 0
+        mean = np.divide(weighted_sum, weight_total, out=x.copy(), where=heard)
+        x = retention * x + (1 - retention) * mean
+        self.inclination[consumers] = np.clip(np.rint(x), 0, 256)
+
+    def reproduce_and_die(self):
+        model = self.model
+        n = len(self)
+        parents = (self.age > 18) & (self.rng.random(n) < model.person_reproduce)
+        dead = self.age > model.max_age
+        if model.capped and parents.any():
+            parents = self.limit_births(parents)
+
+        offspring_is_influencer = self.is_influencer[parents]
+        offspring = (
+            self.cell[parents],
+            self.inclination[parents],
+            np.zeros(len(offspring_is_influencer)),
+            np.where(offspring_is_influencer, INFLUENCER_RADIUS, PERSON_RADIUS),
+            offspring_is_influencer,
+            np.where(offspring_is_influencer, NEWBORN_FOLLOWERS, 0),
+        )
+        self.remove(dead)
+        self.add(*offspring)
+
+    def limit_births(self, parents):
+        """
+        Drops the parents whose child would go over a capacity (see
+        Simulation), taken in random order like the activation of the agents.
+        """
+        model = self.model
+        order = self.rng.permutation(np.flatnonzero(parents))
+        allowed = np.ones(len(order), dtype=bool)
+        if model.cell_capacity:
+            room = model.cell_capacity - np.bincount(self.cell, minlength=self.num_cells)
+            allowed &= get_rank(self.cell[order]) < room[self.cell[order]]
+        if model.territory_capacity and model.territory_labels is not None:
+            labels = model.territory_labels[self.cell]
+            room = model.territory_capacity - np.bincount(labels, minlength=model.number_territory)
+            # Only births that fit in their cell take room in the territory
+            granted = labels[order] * allowed + (~allowed) * model.number_territory
+            rank = get_rank(granted)
+            allowed &= rank < np.append(room, 0)[granted]
+        if model.carrying_capacity:
+            room = max(model.carrying_capacity - len(self), 0)
+            allowed &= np.cumsum(allowed) <= room
+
+        parents = np.zeros(len(parents), dtype=bool)
+        parents[order[allowed]] = True
+        return parents
+
+    def broadcast(self):
+        """
+        Followers move towards the influencers they follow (see broadcast.py).
+        """
+        persons = np.flatnonzero(~self.is_influencer)
+        influencers = np.flatnonzero(self.is_influencer)
+        self.network.update(self.model, self.key[persons], self.key[influencers], self.followers[influencers])
+        self.inclination[persons] = self.network.broadcast(
+            self.inclination[persons], self.inclination[influencers], self.model.broadcast_influence
+        )
+
+    def update_counts(self):
+        """
+        Writes the party counts into the scheduler tally read by the reporters.
+        """
+        set_counts(self.model, *self.get_counts())
+        if self.model.shared is not None:
+            self.publish()
+
+    def publish(self):
+        """
+        Copies the columns & the occupancy of every cell into model.shared.
+        """
+        shared = self.model.shared
+        size = len(self)
+        for column in COLUMNS:
+            values = getattr(self, column)
+            shared.reserve(column, size, values.dtype)[:size] = values
+        shared["size"][0] = size
+        shared["occupancy"][:] = np.bincount(self.cell, minlength=self.num_cells)
+
+    def get_counts(self):
+        """
+        Returns the counts by party of persons & influencers (shape (2, 3))
+        and of the residents of every territory (shape (territories, 3), or
+        None without territories).
+        """
+        party = party_index(self.inclination)
+        type_counts = np.stack([
+            np.bincount(party[~self.is_influencer], minlength=3),
+            np.bincount(party[self.is_influencer], minlength=3),
+        ])
+
+        territory_counts = None
+        if self.model.territory_labels is not None:
+            labels = self.model.territory_labels[self.cell]
+            number_territory = self.model.number_territory
+            territory_counts = np.bincount(labels * 3 + party, minlength=number_territory * 3).reshape(number_territory, 3)
+        return type_counts, territory_counts
+
+
+def get_rank(keys):
+    """
+    Number of earlier elements with the same key, for each element.
+    """
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    first = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+    starts = np.repeat(first, np.diff(np.r_[first, len(keys)]))
+    rank = np.empty(len(keys), dtype=np.int64)
+    rank[order] = np.arange(len(keys)) - starts
+    return rank
+
+
+def set_counts(model, type_counts, territory_counts):
+    """
+    Writes counts from VectorizedPopulation.get_counts into the tally & territory records of model.
+    """
+    tally = model.schedule.tally
+    for type_class, counts in zip((Person, Influencer), type_counts.tolist()):
+        tally.set_counts(type_class, dict(zip(PARTIES, counts)))
+
+    if territory_counts is not None:
+        for record, record_counts in zip(model.territories, territory_counts.tolist()):
+            record.set_counts(dict(zip(PARTIES, record_counts)))
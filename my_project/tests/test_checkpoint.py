@@ -0,0 +1,62 @@
+import pytest
+
+from my_project.checkpoint import load_checkpoint
+from my_project.frames import FrameSimulation
+from my_project.model import Simulation
+from my_project.sink import load_series
+
+PARAMS = {
+    "agents": dict(enable_influencer=True, enable_territory=True, initial_percentage=0.5),
+    "vectorized": dict(vectorized=True, enable_influencer=True, enable_territory=True, initial_percentage=0.5),
+    "broadcast": dict(enable_influencer=True, broadcast_influence=0.3, initial_percentage=0.5),
+    "vectorized_broadcast": dict(vectorized=True, enable_influencer=True, broadcast_influence=0.3, initial_percentage=0.5),
+}
+
+
+@pytest.mark.parametrize("name", PARAMS)
+def test_round_trip(tmp_path, name):
+    path = str(tmp_path / "checkpoint.npz")
+    model = Simulation(seed=3, **PARAMS[name])
+    for _ in range(5):
+        model.step()
+    model.save_checkpoint(path)
+    for _ in range(10):
+        model.step()
+
+    restored = load_checkpoint(Simulation, path)
+    assert restored.schedule.steps == 5
+    for _ in range(10):
+        restored.step()
+    assert model.datacollector.get_model_vars_dataframe().equals(restored.datacollector.get_model_vars_dataframe())
+
+
+def test_round_trip_stream(tmp_path):
+    path = str(tmp_path / "checkpoint.npz")
+    model = Simulation(seed=3, stream_path=str(tmp_path / "run.npy"), stream_chunk=4)
+    for _ in range(6):
+        model.step()
+    model.save_checkpoint(path)
+    for _ in range(6):
+        model.step()
+    model.datacollector.flush()
+    expected = load_series(str(tmp_path / "run.npy"))
+
+    restored = load_checkpoint(Simulation, path)
+    for _ in range(6):
+        restored.step()
+    restored.datacollector.flush()
+    assert len(expected) == 13
+    assert load_series(str(tmp_path / "run.npy")).equals(expected)
+
+
+def test_round_trip_subclass(tmp_path):
+    path = str(tmp_path / "checkpoint.npz")
+    model = FrameSimulation(seed=3, steps_per_frame=2)
+    model.step()
+    model.save_checkpoint(path)
+    model.step()
+
+    restored = load_checkpoint(FrameSimulation, path)
+    restored.steps_per_frame = 2
+    restored.step()
+    assert model.datacollector.get_model_vars_dataframe().equals(restored.datacollector.get_model_vars_dataframe())
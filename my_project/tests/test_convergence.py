@@ -0,0 +1,13 @@
+from my_project.model import Simulation
+
+PARAMS = dict(seed=1, stop_on=["stationary"], stationary_window=20, stationary_tolerance=1.0)
+
+
+def test_stationary_streamed(tmp_path):
+    in_memory = Simulation(**PARAMS)
+    in_memory.run_model(200)
+    # Chunks shorter than the window
+    streamed = Simulation(stream_path=str(tmp_path / "run.npy"), stream_chunk=10, **PARAMS)
+    streamed.run_model(200)
+    assert in_memory.stop_reason == streamed.stop_reason == "stationary"
+    assert in_memory.schedule.steps == streamed.schedule.steps < 200
@@ -0,0 +1,47 @@
+import multiprocessing
+
+import pytest
+
+from my_project.model import Simulation
+from my_project.partition import PartitionedPopulation, TilePopulation, WorkerError
+
+
+def run(steps, **params):
+    model = Simulation(vectorized=True, partitions=2, seed=7, **params)
+    try:
+        for _ in range(steps):
+            model.step()
+        return model.datacollector.get_model_vars_dataframe(), model.population.gather()
+    finally:
+        model.population.close()
+
+
+def test_same_seed_same_data():
+    data, columns = run(20, enable_influencer=True, enable_territory=True)
+    again, columns_again = run(20, enable_influencer=True, enable_territory=True)
+    assert data.equals(again)
+    for name, values in columns.items():
+        assert (values == columns_again[name]).all()
+
+
+def test_shared_memory_same_data():
+    data, _ = run(10)
+    shared, _ = run(10, shared_memory=True)
+    assert data.equals(shared)
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != "fork", reason="the workers must get the patched class")
+def test_failing_worker(monkeypatch):
+    step = TilePopulation.step
+
+    def failing_step(self):
+        if self.strip == 1:
+            raise ValueError("broken strip")
+        step(self)
+
+    monkeypatch.setattr(TilePopulation, "step", failing_step)
+    model = Simulation(vectorized=True, partitions=2, seed=7)
+    assert isinstance(model.population, PartitionedPopulation)
+    with pytest.raises(WorkerError, match="broken strip"):
+        model.step()
+    assert not model.population.workers
@@ -0,0 +1,22 @@
+from my_project.model import Simulation
+from my_project.shared import SharedArrays
+from my_project.vectorized import COLUMNS
+
+
+def test_reader_follows_reallocations():
+    model = Simulation(vectorized=True, shared_memory=True, seed=2, initial_person=20, person_reproduce=0.2)
+    reader = SharedArrays.attach_registry(model.shared.registry.name)
+    try:
+        reallocated = False
+        for _ in range(30):
+            model.step()
+            reallocated |= reader.refresh()
+            size = reader["size"][0]
+            assert size == len(model.population)
+            for column in COLUMNS:
+                assert (reader[column][:size] == getattr(model.population, column)).all()
+        # The population outgrew the first columns
+        assert reallocated
+    finally:
+        reader.close()
+        model.shared.close()
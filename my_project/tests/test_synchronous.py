@@ -0,0 +1,46 @@
+from my_project.agents import Person, Influencer
+from my_project.model import Simulation
+
+# (cell, inclination, age) of the persons & influencers
+PERSONS = [((0, 0), 200, 30), ((0, 1), 10, 12), ((1, 1), 250, 60), ((4, 4), 90, 40), ((3, 0), 0, 20)]
+INFLUENCERS = [((0, 0), 100, 30), ((1, 0), 40, 15), ((4, 3), 180, 70)]
+PARAMS = dict(
+    width=5, height=5, initial_person=len(PERSONS), initial_influencer=len(INFLUENCERS),
+    enable_influencer=True, is_mortal=False, is_mobile=False, seed=1,
+)
+
+
+def step_agents():
+    model = Simulation(synchronous=True, **PARAMS)
+    stepped = []
+    for kind, placement in ((Person, PERSONS), (Influencer, INFLUENCERS)):
+        agents = list(model.schedule.agents_by_type[kind].values())
+        for agent, (pos, inclination, age) in zip(agents, placement):
+            model.index.move_agent(agent, pos)
+            agent.political_party_inclination = inclination
+            agent.age = age
+        stepped += agents
+    model.step()
+    return [agent.political_party_inclination for agent in stepped]
+
+
+def step_vectorized():
+    model = Simulation(vectorized=True, **PARAMS)
+    population = model.population
+    # Persons first, then influencers, like the agents above
+    placement = PERSONS + INFLUENCERS
+    population.cell[:] = [x * model.height + y for (x, y), _, _ in placement]
+    population.inclination[:] = [inclination for _, inclination, _ in placement]
+    population.age[:] = [age for _, _, age in placement]
+    model.step()
+    return population.inclination.tolist()
+
+
+def test_synchronous_agents_match_vectorized():
+    agents = step_agents()
+    vectorized = step_vectorized()
+    assert agents == vectorized
+    # Some influencers did change
+    assert agents[len(PERSONS):] != [inclination for _, inclination, _ in INFLUENCERS]
+    # Only the influencers consume ideas
+    assert agents[:len(PERSONS)] == [inclination for _, inclination, _ in PERSONS]